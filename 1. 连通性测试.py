@@ -1,8 +1,11 @@
 import openai
 import os
+from transport import default_transport
 
 # 获取系统变量(windows)
 openai.api_key = os.getenv("OPENAI_API_KEY")
+# 使用共享的 HTTP 连接池 (长连接复用, 统一超时)
+default_transport.install()
 
 # 创建一个 GPT-3 请求
 response = openai.ChatCompletion.create(
@@ -2,11 +2,14 @@ import os
 
 import openai
 from sklearn.metrics.pairwise import cosine_similarity
+from transport import default_transport
 
 
 def run():
     # 记得改成你的api key
     openai.api_key = os.getenv("OPENAI_API_KEY")
+    # 使用共享的 HTTP 连接池 (长连接复用, 统一超时)
+    default_transport.install()
 
     good_text = "这是一条好评"
     bad_text = "这是一条差评"
@@ -1,7 +1,10 @@
 import openai
 import os
+from transport import default_transport
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
+# 使用共享的 HTTP 连接池 (长连接复用, 统一超时)
+default_transport.install()
 
 # 通过拼接上一次的回复进行多轮对话
 response = openai.ChatCompletion.create(
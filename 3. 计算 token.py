@@ -1,10 +1,12 @@
-import tiktoken
+from tokenizer_registry import default_tokenizers
 
 MODEL_NAME = "gpt-3.5-turbo-0613"
-encoder = tiktoken.encoding_for_model(MODEL_NAME)
+# 在后台加载编码器, 不阻塞启动 (首次使用时若尚未加载完成会等待)
+default_tokenizers.warm([MODEL_NAME])
 
 
 def calculate_and_display_token_count(input_text: str):
+    encoder = default_tokenizers.get(MODEL_NAME)
     encoded_text = encoder.encode(input_text)
     token_count = len(encoded_text)
 
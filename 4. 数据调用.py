@@ -2,8 +2,12 @@ import types
 import pandas as pd
 import openai
 import os
+from stream_sinks import StreamDispatcher, TextSink
+from transport import default_transport
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
+# 使用共享的 HTTP 连接池 (长连接复用, 统一超时)
+default_transport.install()
 
 # 创建一个稍微复杂的 DataFrame，包含多种数据类
 df_complex = pd.DataFrame({
@@ -31,11 +35,11 @@ response = openai.ChatCompletion.create(
 
 # 处理 "流式输出" 或 整体输出
 if type(response) == types.GeneratorType:
+    # 分发器收集每个分块的增量, 分发给接收端 (这里是标准输出, 也可以同时接入文件、WebSocket 等),
+    # 结束后一次性拼接出完整的消息
+    dispatcher = StreamDispatcher([TextSink()])
     for i in response:
-        content = i.choices[0].delta.get('content')
-        # "流式输出" 最后一项 "content" 为空
-        if content:
-            print(content, end="")
+        dispatcher.feed(i)
 
         # print(i)
         ''' 流式输出 示例
@@ -85,7 +89,10 @@ if type(response) == types.GeneratorType:
           ]
         }
         '''
+    # 等待接收端输出完毕; 完整的回复: {"role": "assistant", "content": "..."}
+    response_message = dispatcher.close().messages[0]
 else:
-    print(response.choices[0].message['content'])
+    response_message = response.choices[0].message
+    print(response_message['content'])
 
 
@@ -5,8 +5,12 @@ import types
 import pandas as pd
 import openai
 import os
+from stream_sinks import StreamDispatcher, TextSink
+from transport import default_transport
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
+# 使用共享的 HTTP 连接池 (长连接复用, 统一超时)
+default_transport.install()
 
 """1. 数据"""
 # 示例 DataFrame
@@ -106,11 +110,10 @@ except Exception as e:
 
 # 查看 "流式输出" 或 整体输出
 if type(response) == types.GeneratorType:
+    # 分发器收集函数名与参数的增量, 分发给接收端 (这里将参数输出到标准输出), 结束后一次性拼接
+    dispatcher = StreamDispatcher([TextSink(field='arguments')])
     for i in response:
-        cell_function_call = i.choices[0].delta.get('function_call')
-        # "流式输出" 最后一项 "content" 为空
-        if cell_function_call:
-            print(cell_function_call, end="")
+        dispatcher.feed(i)
 
         # print(i)
         """函数调用 流式输出示例:
@@ -185,9 +188,11 @@ if type(response) == types.GeneratorType:
                 
         """
 
-    # 流式输出
-    raise Exception('流式输出 后续暂未处理')
+    # 拼接后的消息与整体输出的 response["choices"][0]["message"] 格式相同
+    response_message = dispatcher.close().messages[0]
 else:
+    response_message = response["choices"][0]["message"]
+
     # print(response.choices[0].message['content'])
 
     # print(f"response: {response}")
@@ -222,9 +227,9 @@ else:
 """10. 保存 GPT 返回的关键信息(需要调用的函数和相关参数)"""
 # TODO 不能保证 GPT 一定会调用函数, 需要异常处理
 # 保存交互过程中的函数名称
-function_name = response["choices"][0]["message"]["function_call"]["name"]
+function_name = response_message["function_call"]["name"]
 # 加载交互过程中的参数
-function_args = json.loads(response["choices"][0]["message"]["function_call"]["arguments"])
+function_args = json.loads(response_message["function_call"]["arguments"])
 
 # print(f"function_name: {function_name}")
 # print(f"function_args: {function_args}")
@@ -249,7 +254,7 @@ final_response = local_fuction_call(**function_args)
 
 """13. 将本地函数运行的结果追加到上下文 (messages) 中"""
 # 追加第一次模型返回结果消息
-messages.append(response["choices"][0]["message"])
+messages.append(response_message)
 # 追加 function 计算结果，注意：function message 必须要输入关键词 name
 messages.append({"role": "function", "name": function_name, "content": final_response, })
 
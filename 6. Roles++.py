@@ -2,8 +2,11 @@ import json
 import sys
 import openai
 import os
+from transport import default_transport
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
+# 使用共享的 HTTP 连接池 (长连接复用, 统一超时)
+default_transport.install()
 
 """1. 定义角色库"""
 roles = {"医生": """请以一位专业医生的身份回复""",
@@ -3,9 +3,12 @@ import json
 import os
 import openai
 import pandas as pd
+from transport import default_transport
 
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
+# 使用共享的 HTTP 连接池 (长连接复用, 统一超时)
+default_transport.install()
 
 
 # 测试的功能函数
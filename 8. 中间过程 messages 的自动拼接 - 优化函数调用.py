@@ -4,7 +4,14 @@ import inspect
 import os
 import pandas as pd
 
+from response_cache import cache_key
+from retry import default_retry_policy
+from single_flight import default_single_flight
+from transport import default_transport
+
 openai.api_key = os.getenv("OPENAI_API_KEY")
+# 使用共享的 HTTP 连接池 (长连接复用, 统一超时)
+default_transport.install()
 
 
 class AutoFunctionGenerator:
@@ -15,10 +22,13 @@ class AutoFunctionGenerator:
 
     """
 
-    def __init__(self, functions_list, max_attempts=2, output_path=None):
+    def __init__(self, functions_list, max_attempts=2, output_path=None, retry_policy=None, single_flight=None):
         self.functions_list = functions_list
         self.max_attempts = max_attempts
         self.output_path = output_path
+        self.retry_policy = retry_policy or default_retry_policy
+        # 相同在途请求的合并器, 为空时使用 default_single_flight, 为 False 时不合并
+        self.single_flight = default_single_flight if single_flight is None else single_flight or None
 
     def generate_function_descriptions(self):
         """生成功能描述
@@ -81,10 +91,12 @@ class AutoFunctionGenerator:
 
     def _call_openai_api(self, messages):
         # 请根据您的实际情况修改此处的 API 调用
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo-16k-0613",
-            messages=messages,
-        )
+        # 同一进程内多个生成器同时请求相同的函数描述时, 只发出一次请求
+        params = {"model": "gpt-3.5-turbo-16k-0613", "messages": messages}
+        if self.single_flight is None:
+            return self.retry_policy.call(openai.ChatCompletion.create, **params)
+        response = self.single_flight.do(cache_key(params),
+                                         lambda: self.retry_policy.call(openai.ChatCompletion.create, **params))
         return response
 
     def auto_generate(self):
@@ -151,11 +163,12 @@ class ChatConversation:
     - run : 运行聊天会话并获取最终的响应。
     """
 
-    def __init__(self, model="gpt-3.5-turbo-16k-0613"):
+    def __init__(self, model="gpt-3.5-turbo-16k-0613", retry_policy=None):
         """
         初始化ChatConversation类。
         """
         self.model = model
+        self.retry_policy = retry_policy or default_retry_policy
         self.messages = []
         self.function_repository = {}
         # 使用模型 "gpt-3.5-turbo-0613" 会出现报错: Error calling chat model: Rate limit reached for default-gpt-3.5-turbo in organization org-8k1NKQgoSqBcuRs0LqkUOrOp on requests per min. Limit: 3 / min. Please try again in 20s. Contact us through our help center at help.openai.com if you continue to have issues. Please add a payment method to your account to increase your rate limit. Visit https://platform.openai.com/account/billing to add a payment method.
@@ -190,7 +203,7 @@ class ChatConversation:
             params['function_call'] = "auto"
 
         try:
-            return openai.ChatCompletion.create(**params)
+            return self.retry_policy.call(openai.ChatCompletion.create, **params)
         except Exception as e:
             print(f"Error calling chat model: {e}")
             return None
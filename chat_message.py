@@ -0,0 +1,129 @@
+"""紧凑的消息对象
+
+每条消息原本是一个 dict ({"role": ..., "content": ...}, 以及 function_name / function_args), 每个会话各自持有一份;
+进程内有数千个会话时, dict 的开销与重复的字符串占据了大部分内存.
+Message 使用 __slots__, 驻留 (intern) role 与函数名, 并缓存 token 数;
+读取方式与 dict 相同 (message['role'], message.get('content')), 发送请求前通过 to_api_messages 转换为 dict.
+
+内存对比: python chat_message.py --sessions 2000 --turns 20
+"""
+
+import argparse
+import sys
+import tracemalloc
+
+
+class Message:
+    """ 紧凑的消息对象
+
+    属性:
+    - role (str): 角色 (已驻留)
+    - content (str): 内容
+    - name (str): 函数返回消息的函数名 (已驻留)
+    - function_call (tuple): 函数调用 (函数名, 参数), 函数名已驻留
+    - tokens (int): 缓存的 token 数, 未计算时为 None
+
+    方法:
+    - from_dict : 由 dict 创建 (兼容 CLChat 中简化的 function_name / function_args)
+    - get / [] : 与 dict 相同的读取方式
+    - to_dict : 转换为接口使用的 dict
+    """
+
+    __slots__ = ('role', 'content', 'name', 'function_call', 'tokens')
+
+    def __init__(self, role, content=None, name=None, function_call=None, tokens=None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.name = sys.intern(name) if name else None
+        if function_call:
+            function_call = (sys.intern(function_call[0]), function_call[1])
+        self.function_call = function_call
+        self.tokens = tokens
+
+    @classmethod
+    def from_dict(cls, message):
+        """由 dict 创建, 已是 Message 时原样返回"""
+        if isinstance(message, Message):
+            return message
+        function_call = message.get('function_call')
+        if function_call:
+            function_call = (function_call.get('name'), function_call.get('arguments'))
+        elif message.get('function_name'):
+            function_call = (message['function_name'], message.get('function_args'))
+        return cls(message['role'], message.get('content'), message.get('name'), function_call)
+
+    def get(self, key, default=None):
+        if key == 'function_call':
+            if self.function_call is None:
+                return default
+            return {"name": self.function_call[0], "arguments": self.function_call[1]}
+        if key in ('role', 'content', 'name'):
+            value = getattr(self, key)
+            return default if value is None and key != 'content' else value
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, KeyError) is not KeyError
+
+    def keys(self):
+        return [key for key in ('role', 'content', 'name', 'function_call') if key in self]
+
+    def to_dict(self):
+        """转换为接口使用的 dict"""
+        return {key: self[key] for key in self.keys()}
+
+    def __eq__(self, other):
+        if isinstance(other, (Message, dict)):
+            return self.to_dict() == Message.from_dict(other).to_dict()
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+def to_api_messages(messages):
+    """将消息列表转换为接口使用的 dict 列表 (dict 原样保留)"""
+    if messages is None:
+        return None
+    return [message.to_dict() if isinstance(message, Message) else message for message in messages]
+
+
+def _measure(build):
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    sessions = build()
+    size = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot, 'filename'))
+    tracemalloc.stop()
+    return size, sessions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="对比 dict 与 Message 保存会话消息的内存占用")
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--turns', type=int, default=20)
+    args = parser.parse_args()
+
+    def dicts():
+        # 与实际运行相同: 每条消息的 role / 函数名都是运行时产生的字符串
+        return [[message for turn in range(args.turns) for message in (
+            {"role": ''.join(['us', 'er']), "content": f"问题 {session}-{turn}"},
+            {"role": ''.join(['func', 'tion']), "name": ''.join(['feedback', '_rules']), "content": "规则"},
+            {"role": ''.join(['assis', 'tant']), "content": f"回答 {session}-{turn}"},
+        )] for session in range(args.sessions)]
+
+    def messages():
+        return [[Message.from_dict(message) for message in session] for session in dicts()]
+
+    dict_size, _ = _measure(dicts)
+    message_size, _ = _measure(messages)
+    count = args.sessions * args.turns * 3
+    print(f" 会话数: {args.sessions}, 消息数: {count}")
+    print(f" dict   : {dict_size / 1024 / 1024:.2f} MB ({dict_size / count:.1f} 字节/条)")
+    print(f" Message: {message_size / 1024 / 1024:.2f} MB ({message_size / count:.1f} 字节/条)")
+    print(f" 节省: {(1 - message_size / dict_size) * 100:.1f}%")
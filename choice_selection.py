@@ -0,0 +1,134 @@
+"""多个候选回复 (n > 1) 的拆分、计数与选择
+
+设置 n > 1 时一次请求即返回 n 个候选回复, 提示词只发送一次, 而不必为每个候选各发一次完整的请求.
+"流式输出"中各候选的增量交错到达, 由 StreamAssembler 按 choice 序号拆分到各自的累加器;
+这里将每个 choice 整理为 Candidate (消息、结束原因、补全的 token 数), 再由选择函数选出一个.
+
+选择函数 selector(candidates) -> Candidate, 内置 (可按名称指定):
+- first : 第一个
+- longest / shortest : 内容最长 / 最短
+- finished : 优先完整结束的 (finish_reason 为 stop 或 function_call), 其中取第一个
+- ask : 列出所有候选, 由用户在命令行中选择
+批处理任务可以使用 by_score(score) 按打分函数选择.
+
+使用方式:
+    candidates = stream_candidates(assembler, model)
+    best = select(candidates, 'finished')
+"""
+
+from collections import namedtuple
+
+from token_counter import count_text
+
+# 候选回复: choice 序号, 消息 (dict), 结束原因, 补全的 token 数
+Candidate = namedtuple('Candidate', ['index', 'message', 'finish_reason', 'tokens'])
+
+# 完整结束的 finish_reason (length 为被截断)
+FINISHED_REASONS = ('stop', 'function_call')
+
+
+def completion_tokens(message, model='gpt-3.5-turbo-16k-0613'):
+    """估算一个候选回复的补全 token 数 (内容, 或函数名与参数)"""
+    function_call = message.get('function_call')
+    if function_call:
+        return count_text(function_call.get('name') or '', model) + count_text(function_call.get('arguments') or '', model)
+    return count_text(message.get('content') or '', model)
+
+
+def stream_candidates(assembler, model='gpt-3.5-turbo-16k-0613', exclude=()):
+    """由"流式输出"的拼接器 (StreamAssembler) 整理候选回复
+
+    :param exclude: 排除的 choice 序号 (如函数参数有误的候选)
+    """
+    candidates = []
+    for index in sorted(assembler.choices):
+        if index in exclude:
+            continue
+        accumulator = assembler.choices[index]
+        message = accumulator.message()
+        candidates.append(Candidate(index, message, accumulator.finish_reason, completion_tokens(message, model)))
+    return candidates
+
+
+def response_candidates(response, model='gpt-3.5-turbo-16k-0613'):
+    """由整体输出的响应整理候选回复"""
+    candidates = []
+    for choice in response['choices']:
+        message = choice['message']
+        candidates.append(Candidate(choice.get('index', 0), message, choice.get('finish_reason'),
+                                    completion_tokens(message, model)))
+    return candidates
+
+
+def _content_length(candidate):
+    message = candidate.message
+    function_call = message.get('function_call')
+    return len(function_call.get('arguments') or '') if function_call else len(message.get('content') or '')
+
+
+def first(candidates):
+    return candidates[0]
+
+
+def longest(candidates):
+    return max(candidates, key=_content_length)
+
+
+def shortest(candidates):
+    return min(candidates, key=_content_length)
+
+
+def finished(candidates):
+    for candidate in candidates:
+        if candidate.finish_reason in FINISHED_REASONS:
+            return candidate
+    return candidates[0]
+
+
+def by_score(score):
+    """按打分函数选择得分最高的候选 (得分相同时取序号小的)
+
+    :param score: 打分函数 score(candidate) -> 数值
+    """
+    def selector(candidates):
+        return max(candidates, key=lambda candidate: (score(candidate), -candidate.index))
+    return selector
+
+
+def ask(candidates):
+    """列出所有候选, 由用户在命令行中选择 (输入为空或无效时选择第一个)"""
+    for number, candidate in enumerate(candidates, start=1):
+        message = candidate.message
+        function_call = message.get('function_call')
+        text = (f"调用函数 {function_call.get('name')}({function_call.get('arguments')})" if function_call
+                else message.get('content'))
+        print(f"[{number}] {text}\n")
+    answer = input(f"请选择候选回复 [1-{len(candidates)}]: ").strip()
+    if answer.isdigit() and 1 <= int(answer) <= len(candidates):
+        return candidates[int(answer) - 1]
+    return candidates[0]
+
+
+SELECTORS = {
+    'first': first,
+    'longest': longest,
+    'shortest': shortest,
+    'finished': finished,
+    'ask': ask,
+}
+
+
+def select(candidates, selector='finished'):
+    """选出一个候选回复, 没有候选时返回 None
+
+    :param selector: 选择函数或 SELECTORS 中的名称
+    """
+    if not candidates:
+        return None
+    if len(candidates) == 1:
+        return candidates[0]
+    if isinstance(selector, str):
+        if selector not in SELECTORS:
+            raise ValueError(f"未知的选择函数: {selector!r}, 可选: {sorted(SELECTORS)}")
+        selector = SELECTORS[selector]
+    return selector(candidates)
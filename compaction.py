@@ -0,0 +1,132 @@
+"""后台摘要压缩上下文
+
+直接移除较早的对话会丢失其中的重要信息. 这里在上下文接近预算时, 由更便宜的模型在后台线程中
+将较早的轮次 (连同已有的摘要) 折叠为一条滚动摘要; 压缩不在用户等待的路径上进行 (例如在用户输入时),
+下一次请求前直接采用已完成的摘要, 尚未完成时不等待.
+
+使用方式:
+    compactor = Compactor()
+    compactor.schedule(window)   # 收到回复后: 需要时在后台开始压缩
+    compactor.apply(window)      # 发出请求前: 采用已完成的摘要
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+from logger import logger
+from retry import default_retry_policy
+
+SUMMARY_PROMPT = ("请将以下对话 (可能包含之前的摘要) 压缩为一段简洁的摘要, 保留其中的事实、用户的要求与偏好、"
+                  "函数调用的结果及尚未解决的问题, 省略寒暄; 只输出摘要本身.")
+
+SUMMARY_PREFIX = "以下是之前对话的摘要: \n"
+
+
+def format_transcript(summary, turns):
+    """将摘要与轮次整理为对话记录文本"""
+    lines = []
+    if summary:
+        lines.append(f"[之前的摘要] {summary['content'][len(SUMMARY_PREFIX):]}")
+    for turn in turns:
+        for message in turn:
+            role = message.get('role')
+            if role == 'function':
+                role = f"function({message.get('name')})"
+            content = message.get('content')
+            function_call = message.get('function_call')
+            if function_call:
+                content = f"调用函数 {function_call.get('name')}({function_call.get('arguments')})"
+            lines.append(f"{role}: {content}")
+    return '\n'.join(lines)
+
+
+class Compactor:
+    """ 后台摘要压缩
+
+    属性:
+    - model (str): 生成摘要使用的模型 (比对话模型更便宜)
+    - keep_turns (int): 保留不压缩的最近轮次数
+    - trigger_ratio (float): 上下文达到提示预算的该比例时开始压缩
+    - summary_max_tokens (int): 摘要的最大 token 数
+    - retry_policy (RetryPolicy): 调用失败时的重试策略
+    - api_base (str): 接口地址, 为空时使用 openai.api_base
+    - compactions (int) / saved_tokens (int): 本会话的压缩次数与节省的 token 数
+
+    方法:
+    - schedule : 需要时在后台开始压缩 (不阻塞)
+    - apply : 采用已完成的摘要 (不等待)
+    - report : 本会话的压缩统计
+    - close : 关闭后台线程
+    """
+
+    def __init__(self, model='gpt-3.5-turbo-0613', keep_turns=2, trigger_ratio=0.75, summary_max_tokens=512,
+                 retry_policy=None, api_base=None):
+        self.model = model
+        self.keep_turns = keep_turns
+        self.trigger_ratio = trigger_ratio
+        self.summary_max_tokens = summary_max_tokens
+        self.retry_policy = retry_policy or default_retry_policy
+        self.api_base = api_base
+        self.compactions = 0
+        self.saved_tokens = 0
+        self.failures = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='compaction')
+        # (被摘要的轮次, Future)
+        self._pending = None
+
+    def should_compact(self, window):
+        return (self._pending is None
+                and len(window.turns) > self.keep_turns
+                and window.total >= window.max_prompt_tokens * self.trigger_ratio)
+
+    def schedule(self, window):
+        """需要时在后台开始压缩, 返回是否已开始"""
+        if not self.should_compact(window):
+            return False
+        # 在当前线程中取出快照, 后台线程不访问窗口
+        turns = list(window.turns)[:len(window.turns) - self.keep_turns]
+        transcript = format_transcript(window.summary, turns)
+        self._pending = (turns, self._executor.submit(self._summarize, transcript))
+        logger.debug("开始在后台压缩最早的 %s 轮对话", len(turns))
+        return True
+
+    def _summarize(self, transcript):
+        params = {"model": self.model,
+                  "messages": [{"role": "system", "content": SUMMARY_PROMPT},
+                               {"role": "user", "content": transcript}],
+                  "max_tokens": self.summary_max_tokens,
+                  "temperature": 0}
+        if self.api_base:
+            params['api_base'] = self.api_base
+        response = self.retry_policy.call(openai.ChatCompletion.create, **params)
+        return response["choices"][0]["message"]["content"]
+
+    def apply(self, window):
+        """采用已完成的摘要 (尚未完成时不等待), 返回节省的 token 数"""
+        if self._pending is None or not self._pending[1].done():
+            return 0
+        turns, future = self._pending
+        self._pending = None
+        try:
+            summary = future.result()
+        except Exception as e:
+            self.failures = self.failures + 1
+            logger.warning("压缩上下文失败: %s", e)
+            return 0
+
+        saved = window.compact(turns, {"role": "system", "content": SUMMARY_PREFIX + summary})
+        self.compactions = self.compactions + 1
+        self.saved_tokens = self.saved_tokens + saved
+        logger.info("已压缩较早的 %s 轮对话, 节省 Token 数: %s", len(turns), saved)
+        return saved
+
+    def report(self):
+        """本会话的压缩统计 (dict)"""
+        return {"compactions": self.compactions, "saved_tokens": self.saved_tokens, "failures": self.failures}
+
+    def close(self):
+        # 尚未开始的压缩不再执行 (shutdown 的 cancel_futures 参数需要 Python 3.9+)
+        if self._pending is not None:
+            self._pending[1].cancel()
+        self._executor.shutdown(wait=False)
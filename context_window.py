@@ -0,0 +1,225 @@
+"""按 token 预算滑动的上下文窗口
+
+上下文会随对话无限增长, 每次请求越来越慢、越来越贵, 直至超出模型的上下文上限.
+这里保留 system 消息与固定 (pinned) 的消息, 其余消息按"轮"(以用户消息开始) 分组,
+超出提示预算 (模型上限 - 为回复预留的 token 数) 时从最早的一轮开始整轮移除,
+因此函数调用与函数返回结果总是一起保留或一起移除.
+
+每条消息加入时只计算一次 token 数并缓存, 之后查询上下文大小 (token 数与消息数) 为 O(1),
+每移除一轮只需减去该轮缓存的 token 数; 每条消息的 token 数见 counts.
+
+较早的轮次也可以折叠为一条摘要消息 (见 compaction.py), 摘要位于固定的消息之后.
+窗口内的消息保存为紧凑的 Message 对象 (见 chat_message.py), token 数缓存在消息上.
+"""
+
+from collections import deque
+
+from chat_message import Message
+from logger import logger
+from token_counter import REPLY_PRIMING, count_functions, count_message
+
+# 模型的上下文上限 (按前缀匹配, 长前缀优先)
+CONTEXT_LIMITS = {
+    "gpt-3.5-turbo-16k": 16385,
+    "gpt-3.5-turbo-1106": 16385,
+    "gpt-3.5-turbo": 4097,
+    "gpt-4-32k": 32768,
+    "gpt-4-1106": 128000,
+    "gpt-4": 8192,
+}
+
+DEFAULT_CONTEXT_LIMIT = 4097
+
+# 为回复预留的 token 数
+DEFAULT_COMPLETION_RESERVE = 1024
+
+
+def context_limit(model):
+    """获取模型的上下文上限"""
+    for prefix in sorted(CONTEXT_LIMITS, key=len, reverse=True):
+        if model.startswith(prefix):
+            return CONTEXT_LIMITS[prefix]
+    return DEFAULT_CONTEXT_LIMIT
+
+
+class ContextWindow:
+    """ 按 token 预算滑动的上下文窗口
+
+    属性:
+    - model (str): 模型名称 (用于计算 token 数与上下文上限)
+    - max_prompt_tokens (int): 提示预算, 为空时为 模型上限 - completion_reserve
+    - functions (list): 请求时附带的函数描述 (计入预算)
+    - pinned (list): 固定保留的消息 (system 消息等)
+    - turns (deque): 按轮分组的消息, 每轮为消息列表
+    - summary (Message): 较早轮次的摘要, 没有时为 None
+    - trimmed_messages / trimmed_tokens (int): 累计移除的消息数与 token 数
+
+    方法:
+    - count : 计算一条消息的 token 数 (不加入窗口)
+    - add : 加入一条消息, 超出预算时移除最早的轮次
+    - trim : 移除最早的轮次直至满足预算, 返回被移除的轮次
+    - compact : 用摘要替换最早的若干轮次
+    - pop_turns : 取出最早的若干轮次 (例如交给检索记忆保存)
+    - use_prefix : 使用共享的提示前缀 (已计算 token 数的 system 提示词与函数描述)
+    - messages : 当前窗口内的消息列表 (用于请求)
+    - total : 当前请求的提示 token 数 (包括函数描述)
+    - counts : 窗口内每条消息的 token 数 (与 messages 一一对应)
+    """
+
+    def __init__(self, model='gpt-3.5-turbo-16k-0613', max_prompt_tokens=None,
+                 completion_reserve=DEFAULT_COMPLETION_RESERVE, functions=None):
+        self.model = model
+        self.max_prompt_tokens = max_prompt_tokens or context_limit(model) - completion_reserve
+        self.pinned = []
+        self.turns = deque()
+        self.summary = None
+        self.trimmed_messages = 0
+        self.trimmed_tokens = 0
+        self._pinned_tokens = 0
+        self._turn_tokens = deque()
+        self._turns_total = 0
+        # 窗口内的消息数 (不含摘要)
+        self._message_count = 0
+        self.functions = functions
+
+    @property
+    def functions(self):
+        return self._functions
+
+    @functions.setter
+    def functions(self, functions):
+        # 同一份函数描述无需重新计算
+        if functions is getattr(self, '_functions', None) and functions is not None:
+            return
+        self._functions = functions
+        self._functions_tokens = None
+
+    @property
+    def functions_tokens(self):
+        # 函数描述在首次需要时计算一次
+        if self._functions_tokens is None:
+            self._functions_tokens = count_functions(self._functions, self.model)
+        return self._functions_tokens
+
+    @property
+    def total(self):
+        """当前请求的提示 token 数 (O(1))"""
+        summary_tokens = self.summary.tokens if self.summary else 0
+        return self._pinned_tokens + summary_tokens + self._turns_total + self.functions_tokens + REPLY_PRIMING
+
+    @property
+    def messages(self):
+        """当前窗口内的消息列表 (固定的消息在前)"""
+        messages = list(self.pinned)
+        if self.summary:
+            messages.append(self.summary)
+        for turn in self.turns:
+            messages.extend(turn)
+        return messages
+
+    @property
+    def counts(self):
+        """窗口内每条消息的 token 数 (与 messages 一一对应, 读取缓存, 不重新计算)"""
+        return [message.tokens for message in self.messages]
+
+    def count(self, message):
+        """计算一条消息的 token 数 (不加入窗口), 已缓存时直接返回"""
+        if isinstance(message, Message) and message.tokens is not None:
+            return message.tokens
+        return count_message(message, self.model)
+
+    def add(self, message, pin=False, tokens=None):
+        """加入一条消息, 返回其 token 数
+
+        system 消息与 pin 为 True 的消息固定保留; 用户消息开始新的一轮,
+        其余消息 (回复、函数调用与返回结果) 归入当前一轮.
+        已知 token 数 (tokens) 时不再计算.
+        """
+        if tokens is None:
+            tokens = self.count(message)
+        message = Message.from_dict(message)
+        message.tokens = tokens
+        self._message_count = self._message_count + 1
+        if pin or message.role == 'system':
+            self.pinned.append(message)
+            self._pinned_tokens = self._pinned_tokens + tokens
+        else:
+            if message.role == 'user' or not self.turns:
+                self.turns.append([])
+                self._turn_tokens.append(0)
+            self.turns[-1].append(message)
+            self._turn_tokens[-1] = self._turn_tokens[-1] + tokens
+            self._turns_total = self._turns_total + tokens
+        self.trim()
+        return tokens
+
+    def trim(self):
+        """移除最早的轮次直至满足预算 (当前一轮总是保留), 返回被移除的轮次"""
+        removed = []
+        while self.total > self.max_prompt_tokens and len(self.turns) > 1:
+            turn = self.turns.popleft()
+            tokens = self._turn_tokens.popleft()
+            self._turns_total = self._turns_total - tokens
+            self._message_count = self._message_count - len(turn)
+            self.trimmed_messages = self.trimmed_messages + len(turn)
+            self.trimmed_tokens = self.trimmed_tokens + tokens
+            removed.append(turn)
+
+        if removed:
+            logger.debug("上下文超出预算, 移除最早的 %s 轮对话", len(removed))
+        if self.total > self.max_prompt_tokens:
+            logger.warning("当前一轮对话已超出提示预算: %s > %s", self.total, self.max_prompt_tokens)
+        return removed
+
+    def pop_turns(self, count):
+        """取出最早的 count 轮, 返回被取出的轮次"""
+        removed = []
+        while self.turns and len(removed) < count:
+            removed.append(self.turns.popleft())
+            self._turns_total = self._turns_total - self._turn_tokens.popleft()
+            self._message_count = self._message_count - len(removed[-1])
+        return removed
+
+    def compact(self, turns, summary_message):
+        """用摘要替换最早的若干轮次, 返回节省的 token 数
+
+        turns 为生成摘要时窗口最前面的轮次; 其中已被移除的轮次不再处理
+        (摘要中依然保留了它们的内容), 新的摘要替换旧的摘要.
+
+        :param turns: 被摘要的轮次 (与 self.turns 中的对象相同)
+        :param summary_message: 摘要消息
+        :return: 节省的 token 数
+        """
+        before = self.summary.tokens if self.summary else 0
+        for turn in turns:
+            if self.turns and self.turns[0] is turn:
+                self.turns.popleft()
+                tokens = self._turn_tokens.popleft()
+                self._turns_total = self._turns_total - tokens
+                self._message_count = self._message_count - len(turn)
+                before = before + tokens
+        summary = Message.from_dict(summary_message)
+        summary.tokens = self.count(summary)
+        self.summary = summary
+        return before - summary.tokens
+
+    def use_prefix(self, prefix):
+        """使用共享的提示前缀 (PromptPrefix), 其中的 token 数不再重新计算"""
+        # 前缀中的消息对象由多个会话共享
+        for message in prefix.messages:
+            self.add(message, pin=True, tokens=message.tokens)
+        if prefix.functions:
+            self._functions = prefix.functions
+            self._functions_tokens = prefix.functions_tokens
+
+    def clear(self):
+        """清空 (固定的消息除外)"""
+        self.summary = None
+        self.turns.clear()
+        self._turn_tokens.clear()
+        self._turns_total = 0
+        self._message_count = len(self.pinned)
+
+    def __len__(self):
+        """窗口内的消息数 (不含摘要, O(1))"""
+        return self._message_count
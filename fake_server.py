@@ -0,0 +1,326 @@
+"""本地模拟的 OpenAI 接口
+
+实现 ChatCompletion ("流式输出"与整体输出, 包括 function_call 的增量) 与 Embedding 两个接口,
+可配置延迟、分块速率、429/5xx 错误注入与预设回复, 用于在没有真实接口的环境下进行确定性的离线性能测试.
+
+使用方式:
+- 命令行启动: python fake_server.py --port 8000 --latency 0.2
+  然后设置环境变量 OPENAI_API_BASE=http://127.0.0.1:8000/v1 运行任一示例脚本
+- 代码中启动: server = FakeOpenAIServer(latency=0.2).start(); openai.api_base = server.base_url
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+
+from aiohttp import web
+
+from logger import logger
+
+
+def _approx_tokens(text):
+    """近似的 token 数 (不依赖 tiktoken)"""
+    return max(1, len(text) // 2) if text else 0
+
+
+def _embedding(text, dimensions):
+    """根据文本生成确定性的向量"""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'big')
+    rng = random.Random(seed)
+    return [rng.uniform(-1, 1) for _ in range(dimensions)]
+
+
+class FakeOpenAIServer:
+    """ 本地模拟的 OpenAI 接口
+
+    属性:
+    - host / port (str / int): 监听地址, port 为 0 时自动分配
+    - latency (float): 首个字节前的延迟 (秒)
+    - jitter (float): 延迟的随机波动上限 (秒)
+    - chunk_interval (float): "流式输出"相邻分块的间隔 (秒)
+    - chunk_size (int): "流式输出"每个分块的字符数
+    - error_rate_429 / error_rate_5xx (float): 注入 429 / 503 错误的概率
+    - retry_after (float): 429 错误附带的 Retry-After (秒)
+    - script (list): 预设回复, 依次使用; 元素为文本、{"function_call": {"name", "arguments"}}
+      或 {"error": 状态码}; 用完后回显最后一条用户消息
+      n > 1 时元素也可以是列表 (每个 choice 一项, 不足时重复最后一项)
+    - embedding_dimensions (int): 向量维度
+    - seed (int): 随机数种子 (错误注入与延迟波动)
+    - requests (dict): 各接口收到的请求数, 以及客户端中途断开的"流式输出"数 (cancelled)
+
+    方法:
+    - start : 在后台线程中启动 (启动失败时抛出异常, 如端口已被占用)
+    - stop : 停止
+    - base_url : 接口地址, 用于 openai.api_base 或 OPENAI_API_BASE
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, chunk_interval=0.0, chunk_size=4,
+                 error_rate_429=0.0, error_rate_5xx=0.0, retry_after=1.0, script=None,
+                 embedding_dimensions=1536, seed=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_interval = chunk_interval
+        self.chunk_size = chunk_size
+        self.error_rate_429 = error_rate_429
+        self.error_rate_5xx = error_rate_5xx
+        self.retry_after = retry_after
+        self.script = list(script or [])
+        self.embedding_dimensions = embedding_dimensions
+        self.requests = {"chat": 0, "embeddings": 0, "errors": 0, "cancelled": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self._chat)
+        app.router.add_post('/v1/embeddings', self._embeddings)
+        return app
+
+    # ===== 启动与停止 =====
+    def start(self, timeout=10.0):
+        """在后台线程中启动, 返回自身
+
+        :param timeout: 等待启动的时间 (秒), 超时抛出 TimeoutError; 启动失败时抛出后台线程中的异常
+        """
+        ready = threading.Event()
+        errors = []
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self._start_site())
+            except BaseException as e:
+                errors.append(e)
+                if self._runner is not None:
+                    loop.run_until_complete(self._runner.cleanup())
+                loop.close()
+                ready.set()
+                return
+            self._loop = loop
+            ready.set()
+            loop.run_forever()
+            loop.run_until_complete(self._runner.cleanup())
+            loop.close()
+
+        self._thread = threading.Thread(target=serve, name='fake-openai-server', daemon=True)
+        self._thread.start()
+        if not ready.wait(timeout):
+            raise TimeoutError(f"模拟接口在 {timeout} 秒内未能启动")
+        if errors:
+            self._thread.join()
+            raise errors[0]
+        logger.info("模拟接口已启动: %s", self.base_url)
+        return self
+
+    async def _start_site(self):
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # 自动分配端口时读取实际端口
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ===== 接口 =====
+    async def _delay(self):
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _injected_error(self):
+        """按概率注入错误, 返回错误响应或 None"""
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.error_rate_429:
+            return self._error_response(429)
+        if roll < self.error_rate_429 + self.error_rate_5xx:
+            return self._error_response(503)
+        return None
+
+    def _error_response(self, status):
+        with self._lock:
+            self.requests["errors"] = self.requests["errors"] + 1
+        headers = {"Retry-After": str(self.retry_after)} if status == 429 else {}
+        error_type = "rate_limit_exceeded" if status == 429 else "server_error"
+        body = {"error": {"message": f"模拟错误 ({status})", "type": error_type, "param": None, "code": None}}
+        return web.json_response(body, status=status, headers=headers)
+
+    def _next_reply(self, messages):
+        with self._lock:
+            if self.script:
+                return self.script.pop(0)
+        for message in reversed(messages):
+            if message.get('role') == 'user':
+                return message.get('content') or ''
+        return ''
+
+    async def _chat(self, request):
+        body = await request.json()
+        with self._lock:
+            self.requests["chat"] = self.requests["chat"] + 1
+
+        await self._delay()
+        error = self._injected_error()
+        if error is not None:
+            return error
+
+        reply = self._next_reply(body.get('messages') or [])
+        if isinstance(reply, dict) and 'error' in reply:
+            return self._error_response(reply['error'])
+        # n > 1: 脚本项可以是列表 (每个 choice 一项, 不足时重复最后一项), 否则每个 choice 的回复相同
+        replies = reply if isinstance(reply, list) else [reply]
+        replies = [{"content": r} if isinstance(r, str) else r for r in replies]
+        replies = [replies[min(i, len(replies) - 1)] for i in range(body.get('n') or 1)]
+
+        completion_id = f"chatcmpl-fake{int(time.time() * 1000)}"
+        model = body.get('model', 'gpt-3.5-turbo')
+        if body.get('stream'):
+            return await self._stream_chat(request, completion_id, model, replies)
+
+        choices = []
+        completion_tokens = 0
+        for index, reply in enumerate(replies):
+            message = {"role": "assistant", "content": reply.get('content')}
+            if 'function_call' in reply:
+                message["content"] = None
+                message["function_call"] = reply['function_call']
+            completion_tokens = completion_tokens + _approx_tokens(json.dumps(message, ensure_ascii=False))
+            choices.append({"index": index, "message": message,
+                            "finish_reason": "function_call" if 'function_call' in reply else "stop"})
+        prompt_tokens = _approx_tokens(json.dumps(body.get('messages'), ensure_ascii=False))
+        return web.json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": choices,
+            "usage": {"prompt_tokens": prompt_tokens,
+                      "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    def _stream_deltas(self, reply):
+        """一个 choice 的增量序列: [(delta, finish_reason), ...]"""
+        if 'function_call' in reply:
+            function_call = reply['function_call']
+            deltas = [({"role": "assistant", "content": None,
+                        "function_call": {"name": function_call['name'], "arguments": ""}}, None)]
+            arguments = function_call.get('arguments', '')
+            for i in range(0, len(arguments), self.chunk_size):
+                deltas.append(({"function_call": {"arguments": arguments[i:i + self.chunk_size]}}, None))
+            deltas.append(({}, "function_call"))
+        else:
+            deltas = [({"role": "assistant", "content": ""}, None)]
+            content = reply.get('content') or ''
+            for i in range(0, len(content), self.chunk_size):
+                deltas.append(({"content": content[i:i + self.chunk_size]}, None))
+            deltas.append(({}, "stop"))
+        return deltas
+
+    async def _stream_chat(self, request, completion_id, model, replies):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(index, delta, finish_reason=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": index, "delta": delta, "finish_reason": finish_reason}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            if self.chunk_interval > 0:
+                await asyncio.sleep(self.chunk_interval)
+
+        # 多个 choice 的增量交错发送 (与实际接口相同)
+        sequences = [self._stream_deltas(reply) for reply in replies]
+        try:
+            for step in range(max(len(sequence) for sequence in sequences)):
+                for index, sequence in enumerate(sequences):
+                    if step < len(sequence):
+                        await send(index, *sequence[step])
+
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except (ConnectionResetError, asyncio.CancelledError) as e:
+            # 客户端中途断开
+            with self._lock:
+                self.requests["cancelled"] = self.requests["cancelled"] + 1
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        return response
+
+    async def _embeddings(self, request):
+        body = await request.json()
+        with self._lock:
+            self.requests["embeddings"] = self.requests["embeddings"] + 1
+
+        await self._delay()
+        error = self._injected_error()
+        if error is not None:
+            return error
+
+        inputs = body.get('input')
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        data = [{"object": "embedding", "index": i, "embedding": _embedding(text, self.embedding_dimensions)}
+                for i, text in enumerate(inputs)]
+        tokens = sum(_approx_tokens(text) for text in inputs)
+        return web.json_response({
+            "object": "list",
+            "data": data,
+            "model": body.get('model', 'text-embedding-ada-002'),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI 接口")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help="首个字节前的延迟 (秒)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="延迟的随机波动上限 (秒)")
+    parser.add_argument('--chunk-interval', type=float, default=0.0, help="流式分块的间隔 (秒)")
+    parser.add_argument('--chunk-size', type=int, default=4, help="流式分块的字符数")
+    parser.add_argument('--error-rate-429', type=float, default=0.0)
+    parser.add_argument('--error-rate-5xx', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=1.0, help="429 错误附带的 Retry-After (秒)")
+    parser.add_argument('--embedding-dimensions', type=int, default=1536, help="向量维度")
+    parser.add_argument('--seed', type=int, default=0, help="随机数种子 (错误注入与延迟波动)")
+    parser.add_argument('--script', help="预设回复的 JSON 文件 (列表)")
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script, mode='r', encoding='utf-8') as f:
+            script = json.load(f)
+
+    server = FakeOpenAIServer(host=args.host, port=args.port, latency=args.latency, jitter=args.jitter,
+                              chunk_interval=args.chunk_interval, chunk_size=args.chunk_size,
+                              error_rate_429=args.error_rate_429, error_rate_5xx=args.error_rate_5xx,
+                              retry_after=args.retry_after, script=script,
+                              embedding_dimensions=args.embedding_dimensions, seed=args.seed)
+    print(f"模拟接口地址: {server.base_url}")
+    web.run_app(server.create_app(), host=args.host, port=args.port, print=None)
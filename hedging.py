@@ -0,0 +1,180 @@
+"""对冲请求 (hedged requests)
+
+请求在最近延迟的某个分位数 (例如 p95) 内还没有返回首个分块 ("流式输出") 或完整响应时,
+再发出一个相同的请求, 先完成的一方胜出. 落败一方是"流式输出"时关闭其流;
+整体输出的请求已在线程中执行, 无法中途取消, 会执行到结束 (仍会计费), 结果被丢弃.
+对冲请求的比例有上限, 避免在整体变慢时成倍放大请求量.
+
+还没有足够的延迟样本, 或对冲比例已达上限时, 不会发出对冲请求, 直接在调用方线程中执行,
+不经过线程池; 只有可能对冲的请求才在线程池中执行, 以便在等待延迟分位数时另发对冲请求.
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from logger import logger
+
+
+class LatencyTracker:
+    """ 最近 window 次请求的延迟 (线程安全)
+
+    方法:
+    - record : 记录一次延迟 (秒)
+    - percentile : 计算分位数, 样本不足时返回 None
+    """
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, p):
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        index = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+        return samples[index]
+
+
+class Hedger:
+    """ 对冲请求
+
+    属性:
+    - percentile (float): 超过最近延迟的该分位数仍未返回时发出对冲请求
+    - max_hedge_ratio (float): 对冲请求数占总请求数的上限
+    - tracker (LatencyTracker): 最近的延迟 ("流式输出"为首个分块的延迟)
+    - requests / hedges_fired / hedges_won (int): 请求数 / 发出的对冲数 / 对冲胜出数
+
+    方法:
+    - call : 以对冲方式执行 fn
+    - stats : 返回统计数据
+    """
+
+    def __init__(self, percentile=95, max_hedge_ratio=0.1, window=200, min_samples=20, max_workers=16):
+        self.percentile = percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.tracker = LatencyTracker(window=window, min_samples=min_samples)
+        self.requests = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+
+    def stats(self):
+        """返回统计数据 (dict)"""
+        with self._lock:
+            return {"requests": self.requests,
+                    "hedges_fired": self.hedges_fired,
+                    "hedges_won": self.hedges_won,
+                    "hedge_delay": self.tracker.percentile(self.percentile),
+                    "win_rate": self.hedges_won / self.hedges_fired if self.hedges_fired else 0.0}
+
+    def _can_hedge(self):
+        """对冲比例是否还有余量 (不占用)"""
+        with self._lock:
+            return self.hedges_fired + 1 <= self.max_hedge_ratio * self.requests
+
+    def _allow_hedge(self):
+        with self._lock:
+            if self.hedges_fired + 1 > self.max_hedge_ratio * self.requests:
+                return False
+            self.hedges_fired = self.hedges_fired + 1
+            return True
+
+    def _ready(self, fn, stream):
+        """执行 fn, "流式输出"时等到首个分块到达; 记录延迟"""
+        start = time.monotonic()
+        result = fn()
+        if stream and result is not None:
+            iterator = iter(result)
+            try:
+                first = next(iterator)
+            except StopIteration:
+                result = _Stream(iter(()), iterator)
+            else:
+                result = _Stream(itertools.chain([first], iterator), iterator)
+        self.tracker.record(time.monotonic() - start)
+        return result
+
+    @staticmethod
+    def _discard(future):
+        """关闭落败一方的流 (整体输出的请求无法取消, 只丢弃结果)"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        if isinstance(result, _Stream):
+            result.close()
+
+    def call(self, fn, stream=False, hedge_fn=None):
+        """以对冲方式执行 fn()
+
+        :param fn: 实际发起请求的函数 (需可重复调用)
+        :param stream: fn 是否返回"流式输出"的迭代器
+        :param hedge_fn: 发出对冲请求的函数, 为空时与 fn 相同 (用于分开统计对冲请求与重试)
+        :return: 先完成的一方的结果
+        """
+        with self._lock:
+            self.requests = self.requests + 1
+
+        delay = self.tracker.percentile(self.percentile)
+        if delay is None or not self._can_hedge():
+            # 不会发出对冲请求: 直接在当前线程中执行
+            return self._result(self._ready(fn, stream))
+
+        primary = self._executor.submit(self._ready, fn, stream)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._allow_hedge():
+            return self._result(primary.result())
+
+        logger.debug("请求超过 p%s 延迟 (%.2f 秒), 发出对冲请求", self.percentile, delay)
+        hedge = self._executor.submit(self._ready, hedge_fn or fn, stream)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                # 胜出: 关闭另一方的流; 整体输出的请求无法取消, 执行完后丢弃
+                for loser in pending:
+                    loser.add_done_callback(self._discard)
+                if future is hedge:
+                    with self._lock:
+                        self.hedges_won = self.hedges_won + 1
+                return self._result(future.result())
+        raise error
+
+    @staticmethod
+    def _result(result):
+        if isinstance(result, _Stream):
+            # 与 openai 的"流式输出"一样返回生成器
+            return result.relay()
+        return result
+
+
+class _Stream:
+    """已读取首个分块的流, close() 时关闭原始流"""
+
+    def __init__(self, iterator, source):
+        self._iterator = iterator
+        self._source = source
+
+    def relay(self):
+        try:
+            yield from self._iterator
+        finally:
+            self.close()
+
+    def close(self):
+        close = getattr(self._source, 'close', None)
+        if close:
+            close()
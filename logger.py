@@ -1,7 +1,18 @@
-"""程序日志记录器"""
+"""程序日志记录器
 
+日志记录经队列 (QueueHandler) 交给后台线程 (QueueListener) 格式化与输出.
+请使用 logger.debug("当前上下文: %s", contexts) 的形式传参: 级别未开启时不会构造消息;
+开启时在调用线程中填入参数 (此时参数的状态才是记录时的状态, 之后可能被修改),
+时间、JSON 等格式化与输出留给后台线程.
+"""
+
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
 import os
+import queue
 
 # 设置日志文件路径, 为空将日志输出到控制台
 # log_file_path = os.path.join('.', 'log.log')
@@ -12,35 +23,78 @@ log_file_path = ''
 log_level = logging.INFO
 # log_level = logging.WARNING
 
+# 是否输出为 JSON Lines (每行一条结构化日志)
+log_json = False
+
+# 日志文件按大小轮转: 单个文件的大小上限 (字节) 与保留的历史文件数
+log_max_bytes = 10 * 1024 * 1024
+log_backup_count = 5
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """将日志格式化为一行 JSON"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "file": record.filename,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """ 在调用线程中填入消息参数, 其余格式化留给后台线程
+
+    参数可能是之后会被修改的对象 (如上下文列表), 入队前须先按当时的状态生成消息文本;
+    标准的 QueueHandler 还会在调用线程中完成整条日志的格式化, 这里只生成消息, 并保留异常信息交给后台的格式化器.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
 
-try:
-    # 配置日志输出格式
-    handler = logging.FileHandler(log_file_path, encoding='utf-8')
-# 处理路径不存在
-except FileNotFoundError:
+
+def _create_handler():
+    # 当日志路径 `log_file_path` 为空时将日志输出到控制台
+    if not log_file_path:
+        return logging.StreamHandler()
+
+    # 处理路径不存在
     log_file_location = os.path.dirname(log_file_path)
-    # 创建路径
-    if not os.path.exists(log_file_location):
+    if log_file_location and not os.path.exists(log_file_location):
         os.makedirs(log_file_location)
-    # 创建文件
-    if not os.path.exists(log_file_path):
-        with open(log_file_path, mode='w', encoding='utf-8') as f:
-            pass
-    # 重新配置日志输出格式
-    handler = logging.FileHandler(log_file_path, encoding='utf-8')
-except Exception as e:
-    if not log_file_path:
-        # 当日志路径 `log_file_path` 不存在时将日志输出到控制台
-        handler = logging.StreamHandler()
-    else:
-        print(e)
-        raise
+    return logging.handlers.RotatingFileHandler(log_file_path, maxBytes=log_max_bytes,
+                                                backupCount=log_backup_count, encoding='utf-8')
+
+
+handler = _create_handler()
+# 配置日志输出格式
+if log_json:
+    handler.setFormatter(JsonLinesFormatter(datefmt="%Y-%m-%d %H:%M:%S"))
+else:
+    handler.setFormatter(logging.Formatter(
+        datefmt="%Y-%m-%d %H:%M:%S",
+        fmt="[%(asctime)s %(levelname)s] %(filename)s - %(lineno)d >>> %(message)s"
+    ))
+
+# 后台线程负责格式化和输出
+log_queue = queue.SimpleQueue()
+listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+listener.start()
+# 退出前输出队列中剩余的日志
+atexit.register(listener.stop)
 
 logging.basicConfig(
     level=log_level,
-    handlers=[handler],
-    datefmt="%Y-%m-%d %H:%M:%S",
-    format="[%(asctime)s %(levelname)s] %(filename)s - %(lineno)d >>> %(message)s"
+    handlers=[LazyQueueHandler(log_queue)],
 )
 
 # 创建记录日志的对象 logger
@@ -48,4 +102,3 @@ logger = logging.getLogger(__name__)
 
 # 使用 logger 使用示例
 logger.debug("已开启调试模式! ")
-
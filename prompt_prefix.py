@@ -0,0 +1,134 @@
+"""共享的提示前缀 (system 提示词与函数描述)
+
+每个会话都从磁盘读取 system_prompt.json 并作为第一条消息发送, 每轮都重新计算它的 token 数.
+这里每个进程只读取一次提示词与函数描述文件, 驻留 (intern) 其中的字符串, 并同时保存预先计算的 token 数;
+大量会话引用同一个不可变的前缀对象, 避免重复的文件读取、编码以及数千个会话中重复的数 KB 字符串.
+
+使用方式:
+    prefix = default_prefixes.get(model, system_prompt_path='system_prompt.json',
+                                  functions_path='function_describe.json')
+    chat.use_prefix(prefix)
+"""
+
+import json
+import os
+import sys
+import threading
+
+from chat_message import Message
+from token_counter import count_functions, count_message
+
+
+def _intern(value):
+    """递归驻留 JSON 对象中的字符串"""
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return {_intern(key): _intern(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_intern(item) for item in value]
+    return value
+
+
+def _parse_json(text):
+    # 文件为空时返回 None
+    return _intern(json.loads(text)) if text.strip() else None
+
+
+class PromptPrefix:
+    """ 不可变的提示前缀 (多个会话共享, 请勿修改其中的消息与函数描述)
+
+    属性:
+    - model (str): 计算 token 数使用的模型名称
+    - messages (tuple): 固定在上下文最前面的消息 (system 提示词, Message 对象, 已缓存 token 数)
+    - message_tokens (tuple): 每条消息的 token 数
+    - functions (list): 函数描述, 没有时为 None
+    - functions_tokens (int): 函数描述的 token 数
+    - total (int): 前缀的 token 总数
+    """
+
+    __slots__ = ('model', 'messages', 'message_tokens', 'functions', 'functions_tokens', 'total')
+
+    def __init__(self, model, messages=(), functions=None):
+        setter = super().__setattr__
+        setter('model', model)
+        messages = tuple(Message.from_dict(message) for message in messages)
+        for message in messages:
+            message.tokens = count_message(message, model)
+        setter('messages', messages)
+        setter('message_tokens', tuple(message.tokens for message in messages))
+        setter('functions', functions or None)
+        setter('functions_tokens', count_functions(functions, model))
+        setter('total', sum(self.message_tokens) + self.functions_tokens)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PromptPrefix 不可修改")
+
+    def __repr__(self):
+        return f"PromptPrefix(model={self.model!r}, messages={len(self.messages)}, total={self.total})"
+
+
+class PrefixRegistry:
+    """ 提示前缀注册表 (线程安全)
+
+    方法:
+    - load_text : 读取文本文件 (每个路径只读取一次)
+    - load_json : 读取 JSON 文件 (每个路径只读取一次)
+    - get : 获取由 system 提示词与函数描述组成的前缀 (按模型与路径缓存)
+    """
+
+    def __init__(self):
+        self._files = {}
+        self._prefixes = {}
+        self._lock = threading.Lock()
+
+    def _load(self, path, loader):
+        path = os.path.abspath(path)
+        key = (path, loader)
+        if key not in self._files:
+            with self._lock:
+                if key not in self._files:
+                    with open(path, mode='r', encoding='utf-8') as f:
+                        self._files[key] = loader(f.read())
+        return self._files[key]
+
+    def load_text(self, path):
+        """读取文本文件 (每个路径只读取一次), 返回驻留的字符串"""
+        return self._load(path, sys.intern)
+
+    def load_json(self, path):
+        """读取 JSON 文件 (每个路径只读取一次), 返回其中字符串均已驻留的对象; 文件为空时返回 None"""
+        return self._load(path, _parse_json)
+
+    def get(self, model, system_prompt=None, system_prompt_path=None, functions=None, functions_path=None):
+        """获取提示前缀
+
+        :param model: 模型名称
+        :param system_prompt: system 提示词 (与 system_prompt_path 二选一)
+        :param system_prompt_path: system 提示词文件
+        :param functions: 函数描述列表 (与 functions_path 二选一)
+        :param functions_path: 函数描述文件 (json)
+        :return: PromptPrefix
+        """
+        if system_prompt_path:
+            system_prompt = self.load_text(system_prompt_path)
+        if functions_path:
+            functions = self.load_json(functions_path)
+            functions_key = os.path.abspath(functions_path)
+        else:
+            functions_key = json.dumps(functions, sort_keys=True) if functions else None
+
+        key = (model, system_prompt, functions_key)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            with self._lock:
+                prefix = self._prefixes.get(key)
+                if prefix is None:
+                    messages = [{"role": "system", "content": sys.intern(system_prompt)}] if system_prompt else []
+                    prefix = PromptPrefix(model, messages, functions)
+                    self._prefixes[key] = prefix
+        return prefix
+
+
+# 默认的提示前缀注册表
+default_prefixes = PrefixRegistry()
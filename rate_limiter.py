@@ -0,0 +1,128 @@
+"""客户端限速器 (令牌桶)
+
+按每分钟请求数 (RPM) 与每分钟 token 数 (TPM) 两个预算在本地排队,
+容量不足时在本地等待, 而不是发出请求后再被接口以 429 拒绝.
+同一进程内的多个 OpenaiChat 实例共用同一个限速器即可共享预算.
+"""
+
+import asyncio
+import threading
+import time
+
+from token_counter import count_chat
+
+# 未指定 max_tokens 时为回复预留的 token 数
+DEFAULT_COMPLETION_RESERVE = 256
+
+
+class TokenBucket:
+    """ 令牌桶
+
+    容量为 capacity, 每秒补充 refill_rate 个令牌; 本身不加锁, 由调用方保证线程安全.
+    """
+
+    def __init__(self, capacity, refill_rate):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """取出 amount 个令牌还需等待的时间 (秒)"""
+        self._refill()
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_rate
+
+    def consume(self, amount):
+        self.tokens = self.tokens - amount
+
+
+class RateLimiter:
+    """ RPM + TPM 限速器
+
+    同步模式 (acquire) 线程安全, 异步模式 (aacquire) 在等待时不阻塞事件循环, 两种模式共用同一份预算.
+
+    属性:
+    - rpm (int): 每分钟请求数上限
+    - tpm (int): 每分钟 token 数上限
+    - model (str): 估算 token 时使用的模型名称
+
+    方法:
+    - estimate_tokens : 估算一次请求消耗的 token 数 (messages + functions + 回复预留)
+    - acquire : 同步等待直至预算足够
+    - aacquire : 异步等待直至预算足够
+    """
+
+    def __init__(self, rpm=3500, tpm=90000, model='gpt-3.5-turbo-16k-0613'):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.model = model
+        self._requests = TokenBucket(rpm, rpm / 60)
+        self._tokens = TokenBucket(tpm, tpm / 60)
+        self._lock = threading.Lock()
+
+    def estimate_tokens(self, params):
+        """估算一次请求消耗的 token 数
+
+        :param params: openai.ChatCompletion 的请求参数
+        :return: 估算的 token 数
+        """
+        # 按接口的实际格式计算提示的 token 数
+        tokens = count_chat(params.get('messages') or [], params.get('functions'),
+                            model=params.get('model') or self.model)
+        # n > 1 时每个候选回复各自生成补全
+        return tokens + (params.get('max_tokens') or DEFAULT_COMPLETION_RESERVE) * (params.get('n') or 1)
+
+    def _try_acquire(self, tokens):
+        """预算足够时扣除并返回 0, 否则返回需要等待的时间"""
+        # 单次请求超过桶容量时按桶容量计, 避免永远等待
+        tokens = min(tokens, self.tpm)
+        with self._lock:
+            wait = max(self._requests.wait_time(1), self._tokens.wait_time(tokens))
+            if wait <= 0:
+                self._requests.consume(1)
+                self._tokens.consume(tokens)
+        return wait
+
+    def acquire(self, tokens=0):
+        """同步等待直至预算足够, 返回等待的总时间 (秒)"""
+        start = time.monotonic()
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait <= 0:
+                return time.monotonic() - start
+            time.sleep(wait)
+
+    async def aacquire(self, tokens=0):
+        """异步等待直至预算足够, 返回等待的总时间 (秒)"""
+        start = time.monotonic()
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait <= 0:
+                return time.monotonic() - start
+            await asyncio.sleep(wait)
+
+
+# 按名称共享的限速器
+_shared_limiters = {}
+_shared_lock = threading.Lock()
+
+
+def get_rate_limiter(name='default', rpm=3500, tpm=90000, model='gpt-3.5-turbo-16k-0613'):
+    """获取进程内按名称共享的限速器, 首次获取时按参数创建
+
+    :param name: 限速器名称 (同一组织/同一模型的预算建议用同一名称)
+    :return: RateLimiter
+    """
+    with _shared_lock:
+        limiter = _shared_limiters.get(name)
+        if limiter is None:
+            limiter = RateLimiter(rpm=rpm, tpm=tpm, model=model)
+            _shared_limiters[name] = limiter
+        return limiter
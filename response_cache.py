@@ -0,0 +1,172 @@
+"""对话响应缓存 (精确匹配)
+
+以请求内容 (model, messages, functions, function_call 等) 的哈希为键缓存响应:
+内存 LRU 为第一层, SQLite 文件为可选的持久层; 支持过期时间 (TTL) 与按条目数淘汰.
+"流式输出"的请求会缓存完整的分块, 命中时按原顺序回放, 调用方的流式处理逻辑无需改动.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from openai.openai_object import OpenAIObject
+from openai.util import convert_to_openai_object
+
+from logger import logger
+
+# 参与计算缓存键的请求参数
+KEY_FIELDS = ('model', 'messages', 'functions', 'function_call', 'stream',
+              'n', 'temperature', 'top_p', 'max_tokens', 'stop')
+
+
+def cache_key(params):
+    """根据请求参数计算缓存键 (sha256)"""
+    payload = {field: params[field] for field in KEY_FIELDS if params.get(field) is not None}
+    text = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _to_dict(obj):
+    if isinstance(obj, OpenAIObject):
+        return obj.to_dict_recursive()
+    return obj
+
+
+class ResponseCache:
+    """ 对话响应缓存
+
+    属性:
+    - max_entries (int): 内存层最多缓存的条目数 (LRU 淘汰)
+    - ttl (float): 过期时间 (秒), 为空时不过期
+    - path (str): SQLite 文件路径, 为空时只使用内存层
+    - disk_max_entries (int): 持久层最多缓存的条目数 (淘汰最早写入的条目)
+    - hits / misses (int): 命中与未命中次数
+
+    方法:
+    - get : 读取缓存, 未命中返回 None
+    - set : 写入缓存
+    - get_or_create : 命中时返回缓存的响应, 否则调用 create(params) 并写入缓存
+    - clear : 清空缓存
+    """
+
+    def __init__(self, max_entries=256, ttl=None, path=None, disk_max_entries=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.disk_max_entries = disk_max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses "
+                             "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+            self._db.commit()
+
+    def _expired(self, created_at):
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def _remember(self, key, value, created_at):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """读取缓存 (dict), 未命中或已过期时返回 None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._expired(created_at):
+                    self._memory.move_to_end(key)
+                    return value
+                del self._memory[key]
+
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = json.loads(row[0]), row[1]
+            if self._expired(created_at):
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            # 提升到内存层
+            self._remember(key, value, created_at)
+            return value
+
+    def set(self, key, value):
+        """写入缓存
+
+        :param key: 缓存键
+        :param value: {"stream": False, "response": dict} 或 {"stream": True, "chunks": [dict, ...]}
+        """
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, value, created_at)
+            if self._db is None:
+                return
+            self._db.execute("INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                             (key, json.dumps(value, ensure_ascii=False), created_at))
+            # 按条目数淘汰最早写入的条目
+            self._db.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                             "ORDER BY created_at DESC LIMIT -1 OFFSET ?)", (self.disk_max_entries,))
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def get_or_create(self, params, create):
+        """命中时返回缓存的响应, 否则调用 create(params) 并写入缓存
+
+        :param params: openai.ChatCompletion 的请求参数
+        :param create: 实际发起请求的函数
+        :return: 与 openai.ChatCompletion.create 相同形式的响应 ("流式输出"时为生成器)
+        """
+        key = cache_key(params)
+        value = self.get(key)
+        if value is not None:
+            self.hits = self.hits + 1
+            logger.debug("命中响应缓存: %.12s", key)
+            if value['stream']:
+                return self._replay(value['chunks'])
+            return convert_to_openai_object(value['response'])
+
+        self.misses = self.misses + 1
+        response = create(params)
+        if response is None:
+            return None
+        if params.get('stream'):
+            return self._record(key, response)
+        self.set(key, {"stream": False, "response": _to_dict(response)})
+        return response
+
+    @staticmethod
+    def _replay(chunks):
+        for chunk in chunks:
+            yield convert_to_openai_object(chunk)
+
+    def _record(self, key, response):
+        # 流完整读完后才写入缓存; 调用方提前结束时关闭原始的流 (即关闭连接), 不写入缓存
+        chunks = []
+        try:
+            for chunk in response:
+                chunks.append(_to_dict(chunk))
+                yield chunk
+        finally:
+            close = getattr(response, 'close', None)
+            if close:
+                close()
+        self.set(key, {"stream": True, "chunks": chunks})
@@ -0,0 +1,117 @@
+"""基于词嵌入的检索记忆
+
+长时间运行的助手每次都发送完整的上下文是一种浪费. 这里将最近几轮以外的对话移入记忆,
+每轮只调用一次 text-embedding-ada-002 (与 10.通过词嵌入判断语义的相似性.py 相同的接口) 计算词嵌入;
+每次请求只附带与当前问题最相关的 top_k 轮与最近的几轮, 提示大小不随会话长度增长.
+检索 (计算词嵌入与相似度) 增加的延迟会被记录.
+"""
+
+import time
+
+import openai
+
+from compaction import format_transcript
+from logger import logger
+from retry import default_retry_policy
+from telemetry import Histogram
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _similarity(query, vectors):
+    """余弦相似度 (ada-002 的词嵌入已归一化, 即点积)"""
+    if numpy is not None and vectors:
+        return (numpy.asarray(vectors) @ numpy.asarray(query)).tolist()
+    return [sum(a * b for a, b in zip(query, vector)) for vector in vectors]
+
+
+class RetrievalMemory:
+    """ 基于词嵌入的检索记忆
+
+    属性:
+    - top_k (int): 每次请求附带的最相关的轮次数
+    - recent_turns (int): 总是附带的最近轮次数
+    - min_score (float): 相似度低于该值的轮次不附带
+    - model (str): 词嵌入模型
+    - api_base (str): 接口地址, 为空时使用 openai.api_base
+    - retry_policy (RetryPolicy): 调用失败时的重试策略
+    - turns (list): 记忆中的轮次
+    - vectors (list): 与 turns 一一对应的词嵌入
+    - latency (Histogram): 每次检索增加的延迟 (秒)
+
+    方法:
+    - recall : 将较早的轮次移入记忆, 返回本次请求的消息列表
+    - stats : 检索统计
+    """
+
+    def __init__(self, top_k=3, recent_turns=4, min_score=0.0, model='text-embedding-ada-002', api_base=None,
+                 retry_policy=None):
+        self.top_k = top_k
+        self.recent_turns = recent_turns
+        self.min_score = min_score
+        self.model = model
+        self.api_base = api_base
+        self.retry_policy = retry_policy or default_retry_policy
+        self.turns = []
+        self.vectors = []
+        self.latency = Histogram()
+        self.embedded_texts = 0
+        self._query = None
+
+    def _embed(self, texts):
+        params = {"model": self.model, "input": texts}
+        if self.api_base:
+            params['api_base'] = self.api_base
+        response = self.retry_policy.call(openai.Embedding.create, **params)
+        self.embedded_texts = self.embedded_texts + len(texts)
+        return [item["embedding"] for item in sorted(response["data"], key=lambda item: item["index"])]
+
+    def recall(self, window, query):
+        """将最近 recent_turns 轮以外的轮次移入记忆, 返回本次请求的消息列表
+
+        新移入的轮次与问题在同一次请求中计算词嵌入; 同一问题的词嵌入只计算一次 (例如函数调用后的第二次请求).
+
+        :param window: ContextWindow
+        :param query: 当前的问题 (用户消息的内容)
+        :return: 固定的消息 + 摘要 + 相关的轮次 + 最近的轮次
+        """
+        start = time.monotonic()
+        # 当前一轮总是保留在窗口中
+        count = max(0, len(window.turns) - max(1, self.recent_turns))
+        evicted = [window.turns[i] for i in range(count)]
+
+        texts = [format_transcript(None, [turn]) for turn in evicted]
+        if self._query is None or self._query[0] != query:
+            texts.append(query)
+        if texts:
+            # 计算成功后才从窗口中移出
+            vectors = self._embed(texts)
+            if len(vectors) > len(evicted):
+                self._query = (query, vectors.pop())
+            self.turns.extend(window.pop_turns(count))
+            self.vectors.extend(vectors)
+
+        # 相关的轮次按原来的顺序排列
+        scores = _similarity(self._query[1], self.vectors) if self.turns else []
+        ranked = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+        selected = sorted(i for i in ranked[:self.top_k] if scores[i] >= self.min_score)
+
+        messages = list(window.pinned)
+        if window.summary:
+            messages.append(window.summary)
+        for i in selected:
+            messages.extend(self.turns[i])
+        for turn in window.turns:
+            messages.extend(turn)
+
+        elapsed = time.monotonic() - start
+        self.latency.observe(elapsed)
+        logger.debug("检索记忆: %s 轮中选取 %s 轮, 耗时 %.3f 秒", len(self.turns), len(selected), elapsed)
+        return messages
+
+    def stats(self):
+        """检索统计 (dict)"""
+        return {"turns": len(self.turns), "embedded_texts": self.embedded_texts, "latency": self.latency.summary()}
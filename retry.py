@@ -0,0 +1,166 @@
+"""调用重试策略
+
+指数退避 + 完全抖动 (full jitter), 优先遵循服务端的 Retry-After 提示;
+区分可重试与不可重试的错误, 并为每次调用设置重试预算 (次数与总耗时).
+"""
+
+import asyncio
+import email.utils
+import random
+import time
+
+import openai
+
+from logger import logger
+
+# 可重试的错误 (限速、超时、连接失败、服务端错误)
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
+# 不可重试的错误 (请求本身有误, 重试也不会成功)
+NON_RETRYABLE_ERRORS = (
+    openai.error.InvalidRequestError,
+    openai.error.AuthenticationError,
+    openai.error.PermissionError,
+    openai.error.InvalidAPIType,
+    openai.error.SignatureVerificationError,
+)
+
+# 可重试的 HTTP 状态码
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class RetryBudgetExceeded(Exception):
+    """重试预算耗尽, 保留最后一次错误"""
+
+    def __init__(self, attempts, last_error):
+        super().__init__(f"重试 {attempts} 次后依然失败: {last_error}")
+        self.attempts = attempts
+        self.last_error = last_error
+
+
+class RetryPolicy:
+    """ 重试策略
+
+    第 n 次重试前等待 random(0, min(max_delay, base_delay * multiplier ** n)) 秒 (完全抖动),
+    避免大量客户端同步重试; 服务端给出 Retry-After 时以其为准 (不超过 max_delay).
+
+    属性:
+    - max_retries (int): 每次调用最多重试次数
+    - base_delay (float): 退避基数 (秒)
+    - max_delay (float): 单次等待上限 (秒)
+    - multiplier (float): 退避倍率
+    - max_elapsed (float): 每次调用的总耗时预算 (秒), 为空时不限制
+
+    方法:
+    - is_retryable : 判断错误是否可重试
+    - next_delay : 计算下一次重试前的等待时间
+    - call : 按策略调用函数 (同步)
+    - acall : 按策略调用协程函数 (异步)
+    """
+
+    def __init__(self, max_retries=5, base_delay=0.5, max_delay=20.0, multiplier=2.0, max_elapsed=60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.max_elapsed = max_elapsed
+
+    @staticmethod
+    def is_retryable(error):
+        """判断错误是否可重试
+
+        :param error: 捕获的异常
+        :return: bool
+        """
+        if isinstance(error, NON_RETRYABLE_ERRORS):
+            return False
+        if isinstance(error, RETRYABLE_ERRORS):
+            return True
+        # 其余 API 错误按 HTTP 状态码判断
+        if isinstance(error, openai.error.OpenAIError):
+            status = error.http_status
+            return status is None or status in RETRYABLE_STATUS
+        # 网络层异常 (requests / aiohttp 未被包装的情况)
+        return isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError))
+
+    @staticmethod
+    def retry_after(error):
+        """读取服务端给出的 Retry-After 提示 (秒), 没有时返回 None"""
+        headers = getattr(error, 'headers', None) or {}
+        # 毫秒精度的提示优先
+        value = headers.get('retry-after-ms')
+        if value:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            # HTTP 日期格式
+            try:
+                retry_at = email.utils.parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+            return max(0.0, retry_at.timestamp() - time.time())
+
+    def next_delay(self, retries, error=None):
+        """计算第 retries 次重试前的等待时间 (秒)"""
+        hint = self.retry_after(error) if error is not None else None
+        if hint is not None:
+            return min(hint, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * self.multiplier ** retries))
+
+    def _check(self, error, retries, start):
+        """判断是否继续重试, 返回等待时间; 不再重试时抛出异常"""
+        if not self.is_retryable(error):
+            raise error
+        if retries >= self.max_retries:
+            raise RetryBudgetExceeded(retries + 1, error) from error
+
+        delay = self.next_delay(retries, error)
+        if self.max_elapsed is not None and time.monotonic() - start + delay > self.max_elapsed:
+            raise RetryBudgetExceeded(retries + 1, error) from error
+
+        logger.info("调用 GPT 失败(%s), %.2f 秒后进行第 %s 次重试...", type(error).__name__, delay, retries + 1)
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        """按策略调用 func(*args, **kwargs), 返回其结果
+
+        不可重试的错误原样抛出; 预算耗尽时抛出 RetryBudgetExceeded
+        """
+        start = time.monotonic()
+        retries = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                delay = self._check(e, retries, start)
+            time.sleep(delay)
+            retries = retries + 1
+
+    async def acall(self, func, *args, **kwargs):
+        """按策略调用协程函数 func(*args, **kwargs), 返回其结果"""
+        start = time.monotonic()
+        retries = 0
+        while True:
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._check(e, retries, start)
+            await asyncio.sleep(delay)
+            retries = retries + 1
+
+
+# 默认的重试策略
+default_retry_policy = RetryPolicy()
@@ -0,0 +1,277 @@
+"""只追加的会话存储
+
+每次 join_contexts 追加一条记录到会话的 JSON Lines 分段文件 (可选 zstd 压缩, 每条记录单独压缩为一帧),
+同时在偏移索引中追加一项 (分段号, 偏移, 长度, 轮次); 固定的消息 (system 提示词等) 另有一个索引.
+恢复会话时通过 mmap 读取索引, 二分查找最近 N 轮的起点, 只读取并解析这些记录,
+即使会话中存储了数百万轮对话也无需解析整个文件.
+
+目录结构 (root 下):
+- <session_id>.<分段号>.jsonl[.zst] : 记录 {"message", "tokens", "pin", "time"}
+- <session_id>.idx : 对话消息的索引, 每项 INDEX_FORMAT
+- <session_id>.pin.idx : 固定消息的索引
+- <session_id>.meta.json : 会话的元数据 (如累计消耗的 token 数)
+
+zstd 压缩需要安装 zstandard (pip install zstandard).
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from chat_message import Message
+from logger import logger
+
+# 索引项: 分段号, 偏移, 长度, 轮次
+INDEX_FORMAT = struct.Struct('<IQII')
+
+
+class _SessionWriter:
+    """单个会话的追加写入 (由 SessionStore 加锁)"""
+
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+        self.segment = 0
+        self.data = None
+        self.offset = 0
+        self.turn = 0
+
+        self.index = self._open_index(store._path(session_id, 'idx'))
+        self.pin_index = self._open_index(store._path(session_id, 'pin.idx'))
+        # 从已有的索引恢复分段号与轮次
+        last = store._last_entry(session_id)
+        if last is not None:
+            self.segment, _, _, self.turn = last
+        self._open_segment()
+
+    @staticmethod
+    def _open_index(path):
+        """以追加方式打开索引; 中途退出留下的不完整索引项截掉, 使之后的索引项保持对齐"""
+        index = open(path, mode='ab')
+        size = index.tell()
+        aligned = size // INDEX_FORMAT.size * INDEX_FORMAT.size
+        if aligned != size:
+            logger.warning("索引 %s 末尾有不完整的索引项 (%s 字节), 已截掉", path, size - aligned)
+            index.truncate(aligned)
+        return index
+
+    def _open_segment(self):
+        self.data = open(self.store._segment_path(self.session_id, self.segment), mode='ab')
+        self.offset = self.data.tell()
+
+    def append(self, record, role, pin):
+        if not pin and role == 'user':
+            self.turn = self.turn + 1
+        if self.offset >= self.store.segment_max_bytes:
+            self.data.close()
+            self.segment = self.segment + 1
+            self._open_segment()
+
+        payload = self.store._encode(record)
+        self.data.write(payload)
+        self.data.flush()
+        # 先写数据再写索引: 中途退出时最多留下一条没有索引的记录
+        index = self.pin_index if pin else self.index
+        index.write(INDEX_FORMAT.pack(self.segment, self.offset, len(payload), self.turn))
+        index.flush()
+        self.offset = self.offset + len(payload)
+
+    def close(self):
+        for f in (self.data, self.index, self.pin_index):
+            f.close()
+
+
+class SessionStore:
+    """ 只追加的会话存储 (线程安全)
+
+    属性:
+    - root (str): 存储目录
+    - compress (bool): 是否使用 zstd 压缩每条记录
+    - segment_max_bytes (int): 单个分段文件的大小上限 (字节), 超出后写入新的分段
+    - max_open_writers (int): 同时打开的会话数上限; 每个会话占用 3 个文件句柄,
+      超出时关闭最久未写入的会话, 再次写入时重新打开 (按索引恢复分段号与轮次)
+
+    方法:
+    - append : 追加一条消息
+    - load : 读取会话的固定消息与最近 N 轮的消息
+    - turns : 会话的轮次数
+    - save_meta / load_meta : 保存 / 读取会话的元数据
+    - sessions : 所有会话的 id
+    - close : 关闭所有文件
+    """
+
+    def __init__(self, root=os.path.join('.', 'sessions'), compress=False, segment_max_bytes=64 * 1024 * 1024,
+                 max_open_writers=64):
+        if compress and zstandard is None:
+            raise ImportError("zstd 压缩需要安装 zstandard: pip install zstandard")
+        self.root = root
+        self.compress = compress
+        self.segment_max_bytes = segment_max_bytes
+        self.max_open_writers = max_open_writers
+        # 打开的会话 (最近写入的在后)
+        self._writers = OrderedDict()
+        self._lock = threading.Lock()
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    # ===== 路径与编码 =====
+    def _path(self, session_id, suffix):
+        return os.path.join(self.root, f"{session_id}.{suffix}")
+
+    def _segment_path(self, session_id, segment):
+        suffix = 'jsonl.zst' if self.compress else 'jsonl'
+        return self._path(session_id, f"{segment:06d}.{suffix}")
+
+    def _encode(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        if self.compress:
+            return zstandard.ZstdCompressor().compress(line)
+        return line
+
+    def _decode(self, payload):
+        if self.compress:
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        return json.loads(payload)
+
+    # ===== 写入 =====
+    def append(self, session_id, message, tokens=None, pin=False):
+        """追加一条消息
+
+        :param session_id: 会话 id
+        :param message: 消息 (dict)
+        :param tokens: 消息的 token 数 (恢复时不再计算)
+        :param pin: 是否为固定的消息
+        """
+        if isinstance(message, Message):
+            message = message.to_dict()
+        record = {"message": message, "tokens": tokens, "pin": pin, "time": time.time()}
+        with self._lock:
+            writer = self._writers.get(session_id)
+            if writer is None:
+                writer = self._writers[session_id] = _SessionWriter(self, session_id)
+                # 关闭最久未写入的会话, 限制打开的文件句柄数
+                while len(self._writers) > self.max_open_writers:
+                    _, idle = self._writers.popitem(last=False)
+                    idle.close()
+            else:
+                self._writers.move_to_end(session_id)
+            writer.append(record, message.get('role'), pin)
+
+    def save_meta(self, session_id, meta):
+        """保存会话的元数据 (先写临时文件再替换, 避免中途退出时损坏)"""
+        path = self._path(session_id, 'meta.json')
+        with open(path + '.tmp', mode='w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    # ===== 读取 =====
+    @staticmethod
+    def _map(path):
+        """以只读方式 mmap 文件, 文件不存在或为空时返回 None"""
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+        with open(path, mode='rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _last_entry(self, session_id):
+        entries = [self._index_entry(self._path(session_id, suffix), -1) for suffix in ('idx', 'pin.idx')]
+        entries = [entry for entry in entries if entry is not None]
+        return max(entries) if entries else None
+
+    def _index_entry(self, path, position):
+        index = self._map(path)
+        if index is None:
+            return None
+        with index:
+            count = len(index) // INDEX_FORMAT.size
+            if count == 0:
+                return None
+            return INDEX_FORMAT.unpack_from(index, (position % count) * INDEX_FORMAT.size)
+
+    def _read(self, session_id, entries):
+        """按索引项读取记录 (每个分段只 mmap 一次)"""
+        records = []
+        segments = {}
+        try:
+            for segment, offset, length, _ in entries:
+                if segment not in segments:
+                    segments[segment] = self._map(self._segment_path(session_id, segment))
+                records.append(self._decode(segments[segment][offset:offset + length]))
+        finally:
+            for data in segments.values():
+                if data is not None:
+                    data.close()
+        return records
+
+    def turns(self, session_id):
+        """会话的轮次数"""
+        last = self._index_entry(self._path(session_id, 'idx'), -1)
+        return last[3] if last else 0
+
+    def load(self, session_id, last_turns=None):
+        """读取会话的固定消息与最近 last_turns 轮的消息 (为空时读取全部)
+
+        :return: 记录列表, 每条为 {"message", "tokens", "pin", "time"}, 固定的消息在前
+        """
+        with self._lock:
+            # 写入中的数据已 flush, 可以直接读取
+            pin_index = self._map(self._path(session_id, 'pin.idx'))
+            index = self._map(self._path(session_id, 'idx'))
+        entries = []
+        if pin_index is not None:
+            with pin_index:
+                entries.extend(INDEX_FORMAT.iter_unpack(pin_index[:len(pin_index) // INDEX_FORMAT.size
+                                                                   * INDEX_FORMAT.size]))
+        if index is not None:
+            with index:
+                count = len(index) // INDEX_FORMAT.size
+                start = 0
+                if last_turns is not None and count:
+                    last_turn = INDEX_FORMAT.unpack_from(index, (count - 1) * INDEX_FORMAT.size)[3]
+                    start = self._bisect_turn(index, count, last_turn - last_turns + 1)
+                for i in range(start, count):
+                    entries.append(INDEX_FORMAT.unpack_from(index, i * INDEX_FORMAT.size))
+
+        records = self._read(session_id, entries)
+        logger.debug("已读取会话 %s 的 %s 条记录", session_id, len(records))
+        return records
+
+    @staticmethod
+    def _bisect_turn(index, count, turn):
+        """二分查找第一个轮次 >= turn 的索引项"""
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if INDEX_FORMAT.unpack_from(index, middle * INDEX_FORMAT.size)[3] < turn:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def load_meta(self, session_id):
+        """读取会话的元数据, 不存在时返回 {}"""
+        path = self._path(session_id, 'meta.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path, mode='r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def sessions(self):
+        """所有会话的 id"""
+        return sorted(name[:-len('.idx')] for name in os.listdir(self.root)
+                      if name.endswith('.idx') and not name.endswith('.pin.idx'))
+
+    def close(self):
+        with self._lock:
+            for writer in self._writers.values():
+                writer.close()
+            self._writers = OrderedDict()
@@ -0,0 +1,181 @@
+"""相同请求合并 (single-flight)
+
+多个线程同时发出完全相同的请求时, 只有第一个 (leader) 真正调用接口, 其余等待同一个 Future;
+"流式输出"的分块会分发给每个等待者, 晚到的等待者会先收到已到达的分块.
+所有等待者都放弃 (关闭或丢弃生成器) 后, 源头的流随即关闭, 这次请求也不再被后续的相同请求合并.
+
+不需要合并时, 可以为 OpenaiChat 指定 single_flight=False.
+"""
+
+import threading
+import weakref
+from concurrent.futures import Future
+
+from logger import logger
+
+
+class _Broadcast:
+    """ 将一个流分发给多个订阅者
+
+    不额外开线程: 哪个订阅者需要下一块, 就由它从源头读取, 读到的分块追加到共享缓冲区.
+    订阅者数量降为 0 而流尚未结束时, 关闭源头的流并结束广播.
+    """
+
+    def __init__(self, source, on_done=None):
+        self._source = iter(source)
+        self._on_done = on_done
+        self._chunks = []
+        self._done = False
+        self._error = None
+        self._pulling = False
+        self._subscribers = 0
+        self._cond = threading.Condition()
+
+    def _finish(self, error=None):
+        with self._cond:
+            self._done = True
+            self._error = error
+            self._pulling = False
+            # 不再持有源头的流 (及其连接)
+            self._source = None
+            self._cond.notify_all()
+        if self._on_done:
+            self._on_done()
+
+    def subscribe(self):
+        """返回一个从头开始读取的生成器
+
+        生成器结束、被关闭或被回收时 (包括从未开始迭代的生成器) 取消订阅.
+        """
+        with self._cond:
+            self._subscribers = self._subscribers + 1
+        subscription = [True]
+        generator = self._iterate(subscription)
+        weakref.finalize(generator, self._unsubscribe, subscription)
+        return generator
+
+    def _unsubscribe(self, subscription):
+        with self._cond:
+            if not subscription[0]:
+                return
+            subscription[0] = False
+            self._subscribers = self._subscribers - 1
+            abandoned = self._subscribers == 0 and not self._done
+            source = self._source
+        if not abandoned:
+            return
+        logger.debug("所有订阅者都已放弃, 关闭源头的流")
+        close = getattr(source, 'close', None)
+        try:
+            if close is not None:
+                close()
+        finally:
+            self._finish(RuntimeError("流已被所有订阅者放弃"))
+
+    def _iterate(self, subscription):
+        try:
+            yield from self._read()
+        finally:
+            self._unsubscribe(subscription)
+
+    def _read(self):
+        index = 0
+        while True:
+            pull = False
+            with self._cond:
+                while index >= len(self._chunks) and not self._done and self._pulling:
+                    self._cond.wait()
+                if index < len(self._chunks):
+                    chunk = self._chunks[index]
+                    index = index + 1
+                elif self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                else:
+                    self._pulling = True
+                    pull = True
+
+            if not pull:
+                yield chunk
+                continue
+
+            # 由当前订阅者从源头读取下一块 (读取期间其他订阅者不会关闭源头)
+            try:
+                chunk = next(self._source)
+            except StopIteration:
+                self._finish()
+                continue
+            except Exception as e:
+                self._finish(e)
+                continue
+            with self._cond:
+                self._chunks.append(chunk)
+                self._pulling = False
+                self._cond.notify_all()
+
+
+class SingleFlight:
+    """ 合并同时在途的相同请求
+
+    注意: 合并后的调用方拿到的是同一个响应对象, 只读使用即可.
+
+    属性:
+    - coalesced (int): 被合并 (没有真正发出) 的请求数
+
+    方法:
+    - do : 按键执行 fn, 相同键的并发调用共享同一个结果
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+
+    def do(self, key, fn, stream=False):
+        """按键执行 fn(), 相同键的并发调用共享同一个结果
+
+        :param key: 请求的唯一键 (例如 response_cache.cache_key(params))
+        :param fn: 实际发起请求的函数
+        :param stream: fn 是否返回"流式输出"的迭代器, 是则返回可独立迭代的生成器
+        :return: fn() 的结果
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._flights[key] = future
+            else:
+                self.coalesced = self.coalesced + 1
+
+        if not leader:
+            logger.debug("合并相同的在途请求: %.12s", key)
+            result = future.result()
+            return result.subscribe() if stream and result is not None else result
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            self._forget(key, future)
+            raise
+
+        if not stream or result is None:
+            future.set_result(result)
+            self._forget(key, future)
+            return result
+
+        # 流结束前, 相同的请求都订阅这一个流
+        broadcast = _Broadcast(result, on_done=lambda: self._forget(key, future))
+        future.set_result(broadcast)
+        return broadcast.subscribe()
+
+
+# 进程内默认共享的合并器
+default_single_flight = SingleFlight()
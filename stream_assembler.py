@@ -0,0 +1,148 @@
+"""线性时间拼接"流式输出"
+
+逐个分块执行 content = content + cell_content 在长回复上是 O(n²) 的.
+这里将每个分块的增量放入列表, 需要时再一次性拼接 (O(n)); 同时处理 content、
+function_call 的 name / arguments 以及 finish_reason 的增量, 每个 choice (index) 各有一个累加器.
+
+使用方式:
+    assembler = StreamAssembler()
+    for chunk in response:
+        for delta in assembler.feed(chunk):
+            if delta.content:
+                print(delta.content, end="")
+    message = assembler.message()   # {"role": "assistant", "content": ...} 或包含 function_call
+"""
+
+from collections import namedtuple
+
+# 一个分块中某个 choice 的增量; 没有的字段为 None
+StreamDelta = namedtuple('StreamDelta', ['index', 'role', 'content', 'function_name', 'arguments', 'finish_reason'])
+
+
+class ChoiceAccumulator:
+    """ 单个 choice 的累加器
+
+    属性:
+    - index (int): choice 的序号
+    - role (str): 角色
+    - finish_reason (str): 结束原因, 未结束时为 None
+    - content / function_name / arguments (str): 拼接后的内容 (首次读取时拼接并缓存)
+    """
+
+    __slots__ = ('index', 'role', 'finish_reason', '_content', '_function_name', '_arguments', '_joined')
+
+    def __init__(self, index=0):
+        self.index = index
+        self.role = None
+        self.finish_reason = None
+        self._content = None
+        self._function_name = None
+        self._arguments = None
+        self._joined = {}
+
+    def feed(self, delta):
+        """记录一个增量 (StreamDelta)"""
+        if delta.role:
+            self.role = delta.role
+        if delta.content is not None:
+            self._content = self._append(self._content, delta.content)
+        if delta.function_name:
+            self._function_name = self._append(self._function_name, delta.function_name)
+        if delta.arguments is not None:
+            self._arguments = self._append(self._arguments, delta.arguments)
+        if delta.finish_reason:
+            self.finish_reason = delta.finish_reason
+        self._joined = {}
+
+    @staticmethod
+    def _append(parts, piece):
+        if parts is None:
+            parts = []
+        parts.append(piece)
+        return parts
+
+    def _join(self, name):
+        if name not in self._joined:
+            parts = getattr(self, name)
+            self._joined[name] = None if parts is None else ''.join(parts)
+        return self._joined[name]
+
+    @property
+    def content(self):
+        return self._join('_content')
+
+    @property
+    def function_name(self):
+        return self._join('_function_name')
+
+    @property
+    def arguments(self):
+        return self._join('_arguments')
+
+    @property
+    def is_function_call(self):
+        return self._function_name is not None
+
+    def message(self):
+        """拼接后的消息 (dict), 与整体输出的 choices[i].message 格式相同"""
+        if self.is_function_call:
+            return {"role": self.role or "assistant", "content": None,
+                    "function_call": {"name": self.function_name, "arguments": self.arguments or ''}}
+        return {"role": self.role or "assistant", "content": self.content or ''}
+
+
+class StreamAssembler:
+    """ "流式输出"拼接器
+
+    属性:
+    - choices (dict): choice 序号与 ChoiceAccumulator 的对应
+    - chunks (int): 已处理的分块数
+
+    方法:
+    - feed : 处理一个分块, 返回其中的增量 (StreamDelta 列表)
+    - message : 拼接后的消息
+    - messages : 所有 choice 拼接后的消息 (按序号排列)
+    - finished : 是否所有 choice 都已结束
+    """
+
+    def __init__(self):
+        self.choices = {}
+        self.chunks = 0
+
+    @staticmethod
+    def deltas(chunk):
+        """将分块解析为增量 (StreamDelta 列表); 整体输出的响应 (choices[i].message) 视为一个分块"""
+        deltas = []
+        for choice in chunk.get('choices') or []:
+            delta = choice.get('delta') or choice.get('message') or {}
+            function_call = delta.get('function_call') or {}
+            deltas.append(StreamDelta(index=choice.get('index', 0),
+                                      role=delta.get('role'),
+                                      content=delta.get('content'),
+                                      function_name=function_call.get('name'),
+                                      arguments=function_call.get('arguments'),
+                                      finish_reason=choice.get('finish_reason')))
+        return deltas
+
+    def feed(self, chunk):
+        """处理一个分块, 返回其中的增量 (StreamDelta 列表)"""
+        self.chunks = self.chunks + 1
+        deltas = self.deltas(chunk)
+        for delta in deltas:
+            accumulator = self.choices.get(delta.index)
+            if accumulator is None:
+                accumulator = self.choices[delta.index] = ChoiceAccumulator(delta.index)
+            accumulator.feed(delta)
+        return deltas
+
+    def message(self, index=0):
+        """第 index 个 choice 拼接后的消息, 没有时返回 None"""
+        accumulator = self.choices.get(index)
+        return accumulator.message() if accumulator else None
+
+    def messages(self):
+        return [self.choices[index].message() for index in sorted(self.choices)]
+
+    @property
+    def finished(self):
+        return bool(self.choices) and all(choice.finish_reason for choice in self.choices.values())
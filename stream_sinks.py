@@ -0,0 +1,402 @@
+"""可插拔的"流式输出"接收端 (sink)
+
+原本 CLChat、4. 数据调用.py 与 5. 函数调用.py 都直接将增量 print 到标准输出, 同一套流程无法输出到 WebSocket、文件或测试.
+这里由 StreamDispatcher 解析分块 (StreamAssembler), 将增量事件 (StreamDelta) 分发给同时接入的多个接收端,
+流结束时再分发一个 StreamEnd (拼接后的消息). 每个接收端有自己的缓冲区, 在后台线程 (或 asyncio 任务) 中按批处理事件;
+分发本身只是放入缓冲区, 不会阻塞, 所以较慢的接收端不会拖慢网络读取, 也不会影响其他接收端.
+
+缓冲区超过 max_pending 时的处理 (背压, 每个接收端各自设置):
+- 'coalesce' : 按 choice 合并缓冲区中的增量 (多个候选交错到达时也能合并), 不丢弃任何事件;
+  合并后仍超出时缓冲区继续增长
+- 'drop' : 丢弃最早的增量 (适合只关心最新进度的接收端)
+
+使用方式:
+    dispatcher = StreamDispatcher([TextSink(), CallbackSink(send_to_websocket)])
+    for chunk in response:
+        dispatcher.feed(chunk)
+    message = dispatcher.close().messages[0]   # 等待接收端处理完
+"""
+
+import abc
+import asyncio
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from logger import logger
+from stream_assembler import StreamAssembler, StreamDelta
+
+# 流结束事件: 拼接后的消息 (按 choice 序号排列) 与错误信息 (正常结束时为 None)
+StreamEnd = namedtuple('StreamEnd', ['messages', 'error'])
+
+OVERFLOW_POLICIES = ('coalesce', 'drop')
+
+
+def _concat(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a + b
+
+
+def coalesce(events):
+    """按 choice 合并增量 (StreamDelta), 拼接其中的 content / function_name / arguments
+
+    同一 choice 的增量合并到该 choice 上一个增量的位置, 中间夹着其他 choice 的增量也可以合并
+    (各 choice 内部的顺序不变); 不跨越流结束事件 (StreamEnd), 也不合并到已结束 (finish_reason) 的增量.
+    """
+    merged = []
+    # 当前流中每个 choice 最后一个增量的位置
+    positions = {}
+    for event in events:
+        if not isinstance(event, StreamDelta):
+            merged.append(event)
+            positions = {}
+            continue
+        position = positions.get(event.index)
+        last = merged[position] if position is not None else None
+        if (last is not None and last.finish_reason is None
+                and (event.role is None or event.role == last.role)):
+            merged[position] = StreamDelta(index=last.index,
+                                           role=last.role,
+                                           content=_concat(last.content, event.content),
+                                           function_name=_concat(last.function_name, event.function_name),
+                                           arguments=_concat(last.arguments, event.arguments),
+                                           finish_reason=event.finish_reason)
+        else:
+            positions[event.index] = len(merged)
+            merged.append(event)
+    return merged
+
+
+class StreamSink(abc.ABC):
+    """ 接收端基类: 缓冲区与背压
+
+    write 与 close 不阻塞, 事件由子类 (ThreadedSink / AsyncSink) 在后台按批处理;
+    子类须实现 _wake、join 与 wait_closed (抽象方法).
+    接收端可以复用: close 放入的 StreamEnd 处理完后, 再次 write 即开始接收下一次回复.
+
+    属性:
+    - max_batch (int): 每批事件数的上限
+    - linger (float): 收到事件后等待更多事件凑成一批的时间 (秒), 为 0 时不等待
+    - max_pending (int): 缓冲区的事件数上限, 超出时按 overflow 处理
+    - overflow (str): 'coalesce' (合并, 不丢弃) 或 'drop' (丢弃最早的增量)
+    - batches (int) / events (int) / dropped (int): 已处理的批次数、事件数与丢弃的事件数 (只有 'drop' 会丢弃)
+
+    方法:
+    - write : 放入一批事件
+    - close : 放入流结束事件 (StreamEnd)
+    - join / wait_closed : 等待缓冲区中的事件处理完 (同步 / 异步)
+    """
+
+    def __init__(self, max_batch=64, linger=0.0, max_pending=1024, overflow='coalesce'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow 应为 {OVERFLOW_POLICIES} 之一: {overflow!r}")
+        self.max_batch = max_batch
+        self.linger = linger
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.batches = 0
+        self.events = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        # 缓冲区: StreamDelta 与 StreamEnd
+        self._pending = []
+        self._ends = 0
+        # 触发背压的缓冲区大小: 合并后仍超出 max_pending 时提高, 避免每次放入都重新合并
+        self._threshold = max_pending
+
+    def write(self, events):
+        """放入一批事件 (不阻塞)"""
+        with self._lock:
+            self._pending.extend(events)
+            if len(self._pending) > self._threshold:
+                self._apply_backpressure()
+        self._wake()
+
+    def close(self, end=None):
+        """放入流结束事件 (不阻塞)"""
+        with self._lock:
+            self._pending.append(end if end is not None else StreamEnd([], None))
+            self._ends = self._ends + 1
+        self._wake()
+
+    def _apply_backpressure(self):
+        if self.overflow == 'coalesce':
+            # 不丢弃: 合并后仍超出时让缓冲区继续增长, 到两倍大小时再合并
+            self._pending = coalesce(self._pending)
+            self._threshold = max(self.max_pending, 2 * len(self._pending))
+            if len(self._pending) > self.max_pending:
+                logger.debug("接收端 %s 处理过慢, 合并后缓冲区仍有 %s 个事件", type(self).__name__, len(self._pending))
+            return
+        excess = len(self._pending) - self.max_pending
+        if excess > 0:
+            # 只丢弃增量, 保留流结束事件
+            kept = []
+            for event in self._pending:
+                if excess and isinstance(event, StreamDelta):
+                    excess = excess - 1
+                    self.dropped = self.dropped + 1
+                else:
+                    kept.append(event)
+            self._pending = kept
+            logger.debug("接收端 %s 处理过慢, 已丢弃 %s 个事件", type(self).__name__, self.dropped)
+
+    def _take(self):
+        """取出一批增量 (到流结束事件为止), 返回 (增量列表, 流结束事件或 None)"""
+        with self._lock:
+            limit = min(len(self._pending), self.max_batch)
+            for i in range(limit):
+                if isinstance(self._pending[i], StreamEnd):
+                    batch, end = self._pending[:i], self._pending[i]
+                    del self._pending[:i + 1]
+                    self._ends = self._ends - 1
+                    break
+            else:
+                batch, end = self._pending[:limit], None
+                del self._pending[:limit]
+            if len(self._pending) <= self.max_pending:
+                self._threshold = self.max_pending
+        if batch:
+            self.batches = self.batches + 1
+            self.events = self.events + len(batch)
+        return batch, end
+
+    def _ready(self):
+        """是否凑够一批 (或流已结束)"""
+        return len(self._pending) >= self.max_batch or self._ends > 0
+
+    @abc.abstractmethod
+    def _wake(self):
+        """有新的事件: 唤醒后台的处理 (线程或 asyncio 任务)"""
+
+    @abc.abstractmethod
+    def join(self, timeout=None):
+        """等待缓冲区中的事件处理完"""
+
+    @abc.abstractmethod
+    async def wait_closed(self):
+        """等待缓冲区中的事件处理完 (协程)"""
+
+
+class ThreadedSink(StreamSink):
+    """ 在后台线程中按批处理事件的接收端
+
+    子类重写 handle (处理一批增量) 与 finish (流结束); 二者的异常只记录日志, 不影响其他接收端.
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._condition = threading.Condition(self._lock)
+        self._thread = None
+        self._busy = False
+
+    def _wake(self):
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"sink-{type(self).__name__}", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                # 等待更多事件凑成一批
+                deadline = time.monotonic() + self.linger
+                while not self._ready() and deadline > time.monotonic():
+                    self._condition.wait(deadline - time.monotonic())
+                self._busy = True
+            batch, end = self._take()
+            if batch:
+                self._safe(self.handle, batch)
+            if end is not None:
+                self._safe(self.finish, end)
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+    @staticmethod
+    def _safe(method, argument):
+        try:
+            method(argument)
+        except Exception as e:
+            logger.warning("接收端处理事件失败: %s", e)
+
+    def handle(self, batch):
+        """处理一批增量 (StreamDelta 列表)"""
+
+    def finish(self, end):
+        """流结束 (StreamEnd)"""
+
+    def join(self, timeout=None):
+        """等待缓冲区中的事件处理完, 返回是否已处理完"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    async def wait_closed(self):
+        # 在默认线程池中等待 (asyncio.to_thread 需要 Python 3.9+)
+        await asyncio.get_running_loop().run_in_executor(None, self.join)
+
+
+class CallbackSink(ThreadedSink):
+    """ 以回调函数处理事件的接收端
+
+    :param on_batch: 处理一批增量的函数 on_batch(batch)
+    :param on_end: 流结束时调用的函数 on_end(end), 可为空
+    """
+
+    def __init__(self, on_batch, on_end=None, **options):
+        super().__init__(**options)
+        self.on_batch = on_batch
+        self.on_end = on_end
+
+    def handle(self, batch):
+        self.on_batch(batch)
+
+    def finish(self, end):
+        if self.on_end is not None:
+            self.on_end(end)
+
+
+class TextSink(ThreadedSink):
+    """ 将增量中的文本写入文件对象的接收端 (默认为标准输出)
+
+    :param file: 文件对象, 为空时使用 sys.stdout
+    :param field: 写入的字段, 'content' 或 'arguments'
+    """
+
+    def __init__(self, file=None, field='content', **options):
+        super().__init__(**options)
+        self.file = file
+        self.field = field
+
+    def handle(self, batch):
+        text = ''.join(getattr(event, self.field) or '' for event in batch)
+        if text:
+            file = self.file or sys.stdout
+            file.write(text)
+            file.flush()
+
+
+class AsyncSink(StreamSink):
+    """ 在事件循环中按批处理事件的接收端 (如 WebSocket)
+
+    须在事件循环中创建 (或指定 loop); write / close 可以在任意线程调用.
+    有事件时才在事件循环中运行处理任务, 处理完即结束.
+
+    :param on_batch: 处理一批增量的协程函数 on_batch(batch)
+    :param on_end: 流结束时调用的协程函数 on_end(end), 可为空
+    :param loop: 事件循环, 为空时使用当前运行的事件循环
+    """
+
+    def __init__(self, on_batch, on_end=None, loop=None, **options):
+        super().__init__(**options)
+        self.on_batch = on_batch
+        self.on_end = on_end
+        self.loop = loop or asyncio.get_running_loop()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = None
+
+    def _wake(self):
+        try:
+            in_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self._notify()
+        else:
+            self.loop.call_soon_threadsafe(self._notify)
+
+    def _notify(self):
+        self._idle.clear()
+        if self._task is None or self._task.done():
+            self._task = self.loop.create_task(self._run())
+
+    async def _run(self):
+        if self.linger and not self._ready():
+            await asyncio.sleep(self.linger)
+        while True:
+            batch, end = self._take()
+            if not batch and end is None:
+                break
+            if batch:
+                await self._safe(self.on_batch, batch)
+            if end is not None and self.on_end is not None:
+                await self._safe(self.on_end, end)
+        self._idle.set()
+
+    @staticmethod
+    async def _safe(method, argument):
+        try:
+            await method(argument)
+        except Exception as e:
+            logger.warning("接收端处理事件失败: %s", e)
+
+    def join(self, timeout=None):
+        """在其他线程中等待处理完 (事件循环所在的线程请使用 wait_closed)"""
+        asyncio.run_coroutine_threadsafe(self.wait_closed(), self.loop).result(timeout)
+
+    async def wait_closed(self):
+        await self._idle.wait()
+
+
+class StreamDispatcher:
+    """ 解析分块并将增量事件分发给多个接收端
+
+    属性:
+    - sinks (list): 接收端 (StreamSink)
+    - assembler (StreamAssembler): 拼接器
+    - end (StreamEnd): 流结束事件, 结束前为 None
+
+    方法:
+    - add : 接入一个接收端
+    - feed : 处理一个分块 (整体输出的响应也可以作为一个分块), 返回其中的增量
+    - close / aclose : 结束并分发 StreamEnd, 返回 StreamEnd
+    """
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+        self.assembler = StreamAssembler()
+        self.end = None
+
+    def add(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def feed(self, chunk):
+        """处理一个分块, 将其中的增量分发给接收端 (不阻塞), 返回增量 (StreamDelta 列表)"""
+        deltas = self.assembler.feed(chunk)
+        if deltas:
+            for sink in self.sinks:
+                sink.write(deltas)
+        return deltas
+
+    def _finish(self, error):
+        if self.end is None:
+            self.end = StreamEnd(self.assembler.messages(), error)
+            for sink in self.sinks:
+                sink.close(self.end)
+        return self.end
+
+    def close(self, error=None, wait=True):
+        """结束并分发 StreamEnd
+
+        :param error: 错误信息, 正常结束时为空
+        :param wait: 是否等待所有接收端处理完
+        """
+        end = self._finish(error)
+        if wait:
+            for sink in self.sinks:
+                sink.join()
+        return end
+
+    async def aclose(self, error=None):
+        """结束并分发 StreamEnd, 等待所有接收端处理完 (协程)"""
+        end = self._finish(error)
+        await asyncio.gather(*(sink.wait_closed() for sink in self.sinks))
+        return end
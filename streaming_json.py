@@ -0,0 +1,205 @@
+"""增量解析"流式输出"中的函数参数 (function_call.arguments)
+
+原本要等到"流式输出"结束后才对拼接好的参数执行 json.loads.
+这里在参数片段到达时逐个字符解析顶层对象: 每个顶层键的值结束时立即报告 (键, 值),
+格式错误时尽早抛出 StreamingJSONError, 以便中止请求;
+函数参数的校验可以与"流式输出"的剩余部分同时进行, 而不必等到最后.
+
+使用方式:
+    parser = IncrementalJSONParser()
+    for fragment in fragments:
+        for key, value in parser.feed(fragment):
+            ...
+    arguments = parser.close()
+"""
+
+import json
+
+# 顶层解析状态
+_BEFORE_OBJECT = 'before_object'
+_BEFORE_KEY = 'before_key'          # '{' 或 ',' 之后, 等待键
+_IN_KEY = 'in_key'
+_BEFORE_COLON = 'before_colon'
+_BEFORE_VALUE = 'before_value'
+_IN_VALUE = 'in_value'
+_AFTER_VALUE = 'after_value'        # 等待 ',' 或 '}'
+_DONE = 'done'
+
+_WHITESPACE = ' \t\r\n'
+_VALUE_START = '{["-0123456789tfn'
+_OPENERS = {'{': '}', '[': ']'}
+
+
+class StreamingJSONError(ValueError):
+    """函数参数不是合法的 JSON 对象"""
+
+    def __init__(self, message, position):
+        super().__init__(f"{message} (位置 {position})")
+        self.position = position
+
+
+class IncrementalJSONParser:
+    """ 顶层 JSON 对象的增量解析器
+
+    嵌套的值 (对象、数组) 只跟踪括号与字符串, 在值结束时用 json.loads 解析并校验.
+
+    属性:
+    - result (dict): 已完成的顶层键与值
+    - done (bool): 顶层对象是否已结束
+    - position (int): 已处理的字符数
+
+    方法:
+    - feed : 处理一个片段, 返回其中完成的 (键, 值) 列表
+    - close : 结束解析, 返回完整的对象; 对象不完整时抛出 StreamingJSONError
+    """
+
+    def __init__(self):
+        self.result = {}
+        self.done = False
+        self.position = 0
+        self._state = _BEFORE_OBJECT
+        self._key = None
+        # 当前键或值的片段
+        self._buffer = []
+        # 嵌套值的括号栈
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        # 空对象 '{}' 或键之后是否允许 '}'
+        self._allow_close = False
+
+    def _error(self, message):
+        raise StreamingJSONError(message, self.position)
+
+    def feed(self, fragment):
+        """处理一个片段, 返回其中完成的 (键, 值) 列表"""
+        completed = []
+        start = 0
+        for i, char in enumerate(fragment):
+            state = self._state
+            if state == _IN_VALUE:
+                if self._in_string:
+                    if self._escape:
+                        self._escape = False
+                    elif char == '\\':
+                        self._escape = True
+                    elif char == '"':
+                        self._in_string = False
+                        if not self._stack:
+                            # 字符串值结束
+                            self._buffer.append(fragment[start:i + 1])
+                            completed.append(self._finish_value())
+                    self.position = self.position + 1
+                    continue
+                if char == '"':
+                    self._in_string = True
+                elif char in _OPENERS:
+                    self._stack.append(_OPENERS[char])
+                elif char in '}]':
+                    if self._stack:
+                        if char != self._stack.pop():
+                            self._error("括号不匹配")
+                        if not self._stack:
+                            # 对象或数组值结束
+                            self._buffer.append(fragment[start:i + 1])
+                            completed.append(self._finish_value())
+                    else:
+                        # 数字或常量值结束, 同时是顶层对象的结尾
+                        self._buffer.append(fragment[start:i])
+                        completed.append(self._finish_value())
+                        self._close_object(char)
+                elif char == ',' and not self._stack:
+                    self._buffer.append(fragment[start:i])
+                    completed.append(self._finish_value())
+                    self._state = _BEFORE_KEY
+                    self._allow_close = False
+                elif char in _WHITESPACE and not self._stack:
+                    self._buffer.append(fragment[start:i])
+                    completed.append(self._finish_value())
+                self.position = self.position + 1
+                continue
+
+            if state == _IN_KEY:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._buffer.append(fragment[start:i + 1])
+                    self._key = self._decode(''.join(self._buffer), "键")
+                    self._buffer = []
+                    self._state = _BEFORE_COLON
+                self.position = self.position + 1
+                continue
+
+            if char in _WHITESPACE:
+                pass
+            elif state == _BEFORE_OBJECT:
+                if char != '{':
+                    self._error("函数参数应为 JSON 对象")
+                self._state = _BEFORE_KEY
+                self._allow_close = True
+            elif state == _BEFORE_KEY:
+                if char == '"':
+                    self._state = _IN_KEY
+                    self._buffer = []
+                    start = i
+                elif char == '}' and self._allow_close:
+                    self._close_object(char)
+                else:
+                    self._error("此处应为键")
+            elif state == _BEFORE_COLON:
+                if char != ':':
+                    self._error("键之后应为 ':'")
+                self._state = _BEFORE_VALUE
+            elif state == _BEFORE_VALUE:
+                if char not in _VALUE_START:
+                    self._error("此处应为值")
+                self._state = _IN_VALUE
+                self._buffer = []
+                start = i
+                if char == '"':
+                    self._in_string = True
+                elif char in _OPENERS:
+                    self._stack.append(_OPENERS[char])
+            elif state == _AFTER_VALUE:
+                if char == ',':
+                    self._state = _BEFORE_KEY
+                    self._allow_close = False
+                elif char == '}':
+                    self._close_object(char)
+                else:
+                    self._error("值之后应为 ',' 或 '}'")
+            elif state == _DONE:
+                self._error("对象结束后还有多余的内容")
+            self.position = self.position + 1
+
+        # 片段结束时保存未完成的键或值
+        if self._state in (_IN_KEY, _IN_VALUE):
+            self._buffer.append(fragment[start:])
+        return completed
+
+    def _decode(self, text, what):
+        try:
+            return json.loads(text)
+        except ValueError as e:
+            self._error(f"{what}格式错误: {e}")
+
+    def _finish_value(self):
+        value = self._decode(''.join(self._buffer), f"键 {self._key!r} 的值")
+        self.result[self._key] = value
+        self._buffer = []
+        self._state = _AFTER_VALUE
+        return self._key, value
+
+    def _close_object(self, char):
+        if char != '}':
+            self._error("括号不匹配")
+        self._state = _DONE
+        self.done = True
+
+    def close(self):
+        """结束解析, 返回完整的对象"""
+        if not self.done:
+            self._error("函数参数不完整")
+        return self.result
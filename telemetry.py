@@ -0,0 +1,265 @@
+"""请求延迟统计
+
+记录每次调用的排队等待、建立连接、首个分块、流式吞吐 (分块/秒、token/秒)、总延迟与重试次数,
+汇总为进程内的直方图 (p50/p95/p99), 可导出为本地 JSON 文件或 Prometheus 文本格式.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from logger import logger
+
+# 汇总的指标及其 Prometheus 名称
+METRICS = {
+    "queue_wait": "openai_chat_queue_wait_seconds",
+    "connect_time": "openai_chat_connect_seconds",
+    "time_to_first_chunk": "openai_chat_time_to_first_chunk_seconds",
+    "total_latency": "openai_chat_total_latency_seconds",
+    "chunks_per_second": "openai_chat_chunks_per_second",
+    "tokens_per_second": "openai_chat_tokens_per_second",
+    "retries": "openai_chat_retries",
+}
+
+QUANTILES = (50, 95, 99)
+
+
+class CallRecord:
+    """ 单次调用的记录
+
+    属性:
+    - model (str) / stream (bool): 模型与是否"流式输出"
+    - queue_wait (float): 在限速器 / 信号量前等待的时间 (秒)
+    - connect_time (float): 建立新连接的耗时 (秒), 复用连接时为 0
+    - attempts (int): 实际发出的请求次数 (重试次数 = attempts - 1), 不含对冲请求
+    - hedges (int): 对冲请求 (Hedger) 发出的请求次数
+    - time_to_first_chunk (float): 从调用开始到首个分块 (整体输出时为完整响应) 的时间 (秒)
+    - total_latency (float): 从调用开始到响应读取完毕的时间 (秒)
+    - chunks / tokens (int): 收到的分块数 / 生成的 token 数
+    - error (str): 失败时的错误信息
+    """
+
+    def __init__(self, model=None, stream=False):
+        self.model = model
+        self.stream = stream
+        self.start = time.monotonic()
+        self.queue_wait = 0.0
+        self.connect_time = 0.0
+        self.attempts = 0
+        self.hedges = 0
+        self.time_to_first_chunk = None
+        self.total_latency = None
+        self.chunks = 0
+        self.tokens = 0
+        self.error = None
+
+    @property
+    def retries(self):
+        return max(0, self.attempts - 1)
+
+    def first_chunk(self):
+        if self.time_to_first_chunk is None:
+            self.time_to_first_chunk = time.monotonic() - self.start
+
+    def to_dict(self):
+        streaming = (self.total_latency or 0) - (self.time_to_first_chunk or 0)
+        return {
+            "model": self.model,
+            "stream": self.stream,
+            "queue_wait": self.queue_wait,
+            "connect_time": self.connect_time,
+            "time_to_first_chunk": self.time_to_first_chunk,
+            "total_latency": self.total_latency,
+            "chunks": self.chunks,
+            "tokens": self.tokens,
+            "chunks_per_second": self.chunks / streaming if self.stream and streaming > 0 else None,
+            "tokens_per_second": self.tokens / streaming if self.stream and streaming > 0 else None,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "error": self.error,
+        }
+
+
+class Histogram:
+    """ 保留最近 size 个样本的直方图, 用于计算分位数 """
+
+    def __init__(self, size=2048):
+        self.count = 0
+        self.sum = 0.0
+        self._samples = deque(maxlen=size)
+
+    def observe(self, value):
+        self.count = self.count + 1
+        self.sum = self.sum + value
+        self._samples.append(value)
+
+    def percentile(self, p):
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+    def summary(self):
+        result = {"count": self.count, "sum": self.sum}
+        for q in QUANTILES:
+            result[f"p{q}"] = self.percentile(q)
+        return result
+
+
+class Telemetry:
+    """ 请求延迟统计 (线程安全)
+
+    属性:
+    - histograms (dict): 各指标的直方图
+    - record_path (str): 每次调用的记录追加写入的 JSON Lines 文件, 为空时不写
+
+    方法:
+    - start_call : 开始记录一次调用
+    - track : 跟踪响应 ("流式输出"时包装生成器), 读取完毕时汇总
+    - atrack : 跟踪异步的"流式输出"
+    - finish : 结束并汇总一次调用
+    - snapshot : 返回各指标的分位数
+    - export_json : 导出到本地文件
+    - prometheus_text : 输出 Prometheus 文本格式
+    - serve_prometheus : 在后台线程中提供 /metrics 接口
+    """
+
+    def __init__(self, histogram_size=2048, record_path=None):
+        self.histograms = {name: Histogram(histogram_size) for name in METRICS}
+        self.record_path = record_path
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def start_call(self, model=None, stream=False):
+        return CallRecord(model=model, stream=stream)
+
+    def track(self, record, response):
+        """跟踪响应, 返回与原响应形式相同的对象"""
+        if response is None:
+            record.error = record.error or "empty response"
+            self.finish(record)
+            return response
+        if record.stream:
+            return self._track_stream(record, response)
+
+        record.first_chunk()
+        usage = response.get('usage') if hasattr(response, 'get') else None
+        if usage:
+            record.tokens = usage.get('completion_tokens', 0)
+        self.finish(record)
+        return response
+
+    @staticmethod
+    def _observe_chunk(record, chunk):
+        record.first_chunk()
+        record.chunks = record.chunks + 1
+        # "流式输出"每个有内容的分块约为一个 token
+        for choice in chunk.get('choices', []):
+            delta = choice.get('delta') or {}
+            if delta.get('content') or (delta.get('function_call') or {}).get('arguments'):
+                record.tokens = record.tokens + 1
+
+    def _track_stream(self, record, response):
+        try:
+            for chunk in response:
+                self._observe_chunk(record, chunk)
+                yield chunk
+        except Exception as e:
+            record.error = str(e)
+            raise
+        finally:
+            # 调用方提前结束时关闭原始的流 (即关闭连接), 不等到垃圾回收; 已读完时关闭没有影响
+            close = getattr(response, 'close', None)
+            if close:
+                close()
+            self.finish(record)
+
+    async def atrack(self, record, response):
+        """跟踪异步的"流式输出", 返回异步迭代器"""
+        try:
+            async for chunk in response:
+                self._observe_chunk(record, chunk)
+                yield chunk
+        except Exception as e:
+            record.error = str(e)
+            raise
+        finally:
+            aclose = getattr(response, 'aclose', None)
+            if aclose:
+                await aclose()
+            self.finish(record)
+
+    def finish(self, record):
+        """结束并汇总一次调用"""
+        record.total_latency = time.monotonic() - record.start
+        values = record.to_dict()
+        with self._lock:
+            self.calls = self.calls + 1
+            if record.error:
+                self.errors = self.errors + 1
+            for name, histogram in self.histograms.items():
+                if values.get(name) is not None:
+                    histogram.observe(values[name])
+        if self.record_path:
+            with open(self.record_path, mode='a', encoding='utf-8') as f:
+                f.write(json.dumps(values, ensure_ascii=False) + '\n')
+        logger.debug("调用统计: %s", values)
+
+    def snapshot(self):
+        """返回各指标的分位数 (dict)"""
+        with self._lock:
+            result = {name: histogram.summary() for name, histogram in self.histograms.items()}
+            result["calls"] = self.calls
+            result["errors"] = self.errors
+            return result
+
+    def export_json(self, path):
+        """将各指标的分位数导出到本地文件"""
+        with open(path, mode='w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+    def prometheus_text(self):
+        """输出 Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            for name, metric in METRICS.items():
+                histogram = self.histograms[name]
+                lines.append(f"# TYPE {metric} summary")
+                for q in QUANTILES:
+                    value = histogram.percentile(q)
+                    if value is not None:
+                        lines.append(f'{metric}{{quantile="{q / 100}"}} {value}')
+                lines.append(f"{metric}_sum {histogram.sum}")
+                lines.append(f"{metric}_count {histogram.count}")
+            lines.append("# TYPE openai_chat_calls_total counter")
+            lines.append(f"openai_chat_calls_total {self.calls}")
+            lines.append("# TYPE openai_chat_errors_total counter")
+            lines.append(f"openai_chat_errors_total {self.errors}")
+        return '\n'.join(lines) + '\n'
+
+    def serve_prometheus(self, port=9100, host='127.0.0.1'):
+        """在后台线程中提供 http://host:port/metrics, 返回 HTTPServer"""
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = telemetry.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='telemetry-metrics', daemon=True).start()
+        logger.info("延迟统计接口: http://%s:%s/metrics", host, server.server_address[1])
+        return server
@@ -0,0 +1,138 @@
+"""终端渲染器: 输出 CLChat 的消息气泡与"流式输出"
+
+原本 CLChat.bubble 每轮对话最多调用 4 次 time.sleep(0.1), 每次对话凭空增加约 400 ms 的延迟;
+"流式输出"的每个 token 也各自 print 一次. 这里:
+- 消息气泡 (frame) 直接写入缓冲区, 不等待
+- 终端 (TTY) 模式: 文本先写入缓冲区, 距上次刷新超过 flush_interval (默认 16 ms, 约一帧) 时才一次性输出;
+  token 暂停到达时由后台线程在到期后输出剩余的文本
+- 非终端模式 (输出被重定向到管道或文件, 如基准测试): 使用不带分隔线的简洁气泡, 完全缓冲,
+  只在一轮输出结束或等待用户输入前刷新
+
+使用方式:
+    renderer = TerminalRenderer()
+    renderer.frame('GPT_a')
+    for text in deltas:
+        renderer.write(text)
+    renderer.frame('GPT_b')
+"""
+
+import sys
+import threading
+import time
+
+# 消息气泡: (终端模式, 非终端模式)
+FRAMES = {
+    'user_a': ("===" * 10 + "\n\n" + "-user: ", "-user: "),
+    'user_b': ("\n", "\n"),
+    'GPT_a': ("===\n\n" + "-GPT: ", "-GPT: "),
+    'GPT_b': ("\n\n", "\n"),
+}
+
+# 需要立即输出的气泡 (一轮输出结束, 或之后等待用户输入)
+_FLUSH_FRAMES = ('user_a', 'GPT_b')
+
+
+class TerminalRenderer:
+    """ 终端渲染器 (线程安全)
+
+    属性:
+    - file (file): 输出的文件对象, 为空时使用 sys.stdout (每次输出时读取, 便于重定向)
+    - flush_interval (float): 终端模式下两次刷新的最短间隔 (秒)
+    - tty (bool): 是否为终端模式, 为空时根据 file.isatty() 判断
+    - flushes (int): 已刷新的次数
+
+    方法:
+    - frame : 输出一个消息气泡 (user_a / user_b / GPT_a / GPT_b)
+    - write : 输出一段文本 (按时间合并后刷新)
+    - flush : 立即输出缓冲区中的文本
+    - close : 输出剩余的文本并停止后台线程
+    """
+
+    def __init__(self, file=None, flush_interval=0.016, tty=None):
+        self.file = file
+        self.flush_interval = flush_interval
+        self._tty = tty
+        self.flushes = 0
+        self._buffer = []
+        self._last_flush = 0.0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    @property
+    def stream(self):
+        return self.file or sys.stdout
+
+    @property
+    def tty(self):
+        if self._tty is None:
+            isatty = getattr(self.stream, 'isatty', None)
+            self._tty = bool(isatty and isatty())
+        return self._tty
+
+    def frame(self, style=None):
+        """输出一个消息气泡"""
+        if not style:
+            return
+        if style not in FRAMES:
+            raise ValueError("对气泡(bubble)指定是种类值错误")
+        self.write(FRAMES[style][0 if self.tty else 1])
+        if style in _FLUSH_FRAMES:
+            self.flush()
+
+    def write(self, text):
+        """输出一段文本: 终端模式下按 flush_interval 合并刷新, 非终端模式下只写入缓冲区"""
+        if not text:
+            return
+        with self._condition:
+            self._buffer.append(text)
+            if not self.tty:
+                return
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+            else:
+                # 到期后由后台线程输出
+                self._start()
+                self._condition.notify()
+
+    def flush(self):
+        """立即输出缓冲区中的文本"""
+        with self._condition:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            stream = self.stream
+            stream.write(''.join(self._buffer))
+            stream.flush()
+            self._buffer = []
+            self.flushes = self.flushes + 1
+        self._last_flush = time.monotonic()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='terminal-renderer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        with self._condition:
+            while not self._closed:
+                if not self._buffer:
+                    self._condition.wait()
+                    continue
+                remaining = self._last_flush + self.flush_interval - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                else:
+                    self._flush()
+
+    def close(self):
+        """输出剩余的文本并停止后台线程"""
+        with self._condition:
+            self._flush()
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._closed = False
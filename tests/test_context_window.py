@@ -0,0 +1,115 @@
+"""ContextWindow: 按轮移除、固定消息与 O(1) 计数
+
+每条消息都给出 tokens, 不依赖 tiktoken 编码文件.
+"""
+
+import unittest
+
+from chat_message import Message
+from context_window import ContextWindow
+from token_counter import REPLY_PRIMING
+
+
+def user(content):
+    return {"role": "user", "content": content}
+
+
+def assistant(content):
+    return {"role": "assistant", "content": content}
+
+
+class ContextWindowTest(unittest.TestCase):
+
+    def setUp(self):
+        # 每条消息 10 个 token, 提示预算可容纳固定消息与 REPLY_PRIMING 之外的 50 个 token
+        self.window = ContextWindow(max_prompt_tokens=10 + 50 + REPLY_PRIMING)
+        self.window.add({"role": "system", "content": "系统"}, tokens=10)
+
+    def add_turn(self, number, *replies):
+        self.window.add(user(f"问题 {number}"), tokens=10)
+        for reply in replies:
+            self.window.add(reply, tokens=10)
+
+    def contents(self):
+        return [message.content for message in self.window.messages]
+
+    def test_within_budget(self):
+        self.add_turn(1, assistant("回答 1"))
+        self.add_turn(2, assistant("回答 2"))
+        self.assertEqual(self.window.total, 50 + REPLY_PRIMING)
+        self.assertEqual(self.window.trimmed_messages, 0)
+        self.assertEqual(len(self.window), 5)
+
+    def test_drops_whole_oldest_turns(self):
+        for number in range(1, 4):
+            self.add_turn(number, assistant(f"回答 {number}"))
+        self.assertEqual(self.contents(), ["系统", "问题 2", "回答 2", "问题 3", "回答 3"])
+        self.assertEqual(self.window.trimmed_messages, 2)
+        self.assertEqual(self.window.trimmed_tokens, 20)
+        self.assertLessEqual(self.window.total, self.window.max_prompt_tokens)
+
+    def test_function_call_and_result_stay_together(self):
+        call = {"role": "assistant", "content": None,
+                "function_call": {"name": "get_weather", "arguments": "{}"}}
+        result = {"role": "function", "name": "get_weather", "content": "晴"}
+        self.add_turn(1, call, result, assistant("回答 1"))
+        self.add_turn(2, assistant("回答 2"))
+        # 第一轮 (含函数调用与返回结果) 整轮移除
+        self.assertEqual(self.contents(), ["系统", "问题 2", "回答 2"])
+        self.assertEqual([message.role for message in self.window.messages], ["system", "user", "assistant"])
+
+    def test_current_turn_kept_over_budget(self):
+        self.add_turn(1, assistant("回答 1"))
+        with self.assertLogs('logger', level='WARNING'):
+            self.window.add(user("很长的问题"), tokens=100)
+        self.assertEqual(self.contents(), ["系统", "很长的问题"])
+        self.assertGreater(self.window.total, self.window.max_prompt_tokens)
+
+    def test_trim_returns_removed_turns(self):
+        self.add_turn(1, assistant("回答 1"))
+        self.add_turn(2, assistant("回答 2"))
+        self.window.max_prompt_tokens = 10 + 20 + REPLY_PRIMING
+        removed = self.window.trim()
+        self.assertEqual([[message.content for message in turn] for turn in removed],
+                         [["问题 1", "回答 1"]])
+        self.assertEqual(self.window.trim(), [])
+
+    def test_pinned_messages_kept(self):
+        self.window.add(user("固定的背景"), pin=True, tokens=10)
+        for number in range(1, 4):
+            self.add_turn(number, assistant(f"回答 {number}"))
+        self.assertEqual(self.contents()[:2], ["系统", "固定的背景"])
+        # 固定的消息占用预算, 只剩两轮的空间
+        self.assertEqual(self.contents()[2:], ["问题 2", "回答 2", "问题 3", "回答 3"])
+        self.assertEqual(self.window.trimmed_messages, 2)
+
+    def test_len_and_counts_consistent(self):
+        for number in range(1, 5):
+            self.add_turn(number, assistant(f"回答 {number}"))
+        self.assertEqual(len(self.window), len(self.window.messages))
+        self.assertEqual(self.window.counts, [10] * len(self.window.messages))
+        self.assertEqual(sum(self.window.counts) + REPLY_PRIMING, self.window.total)
+
+        self.window.pop_turns(1)
+        self.assertEqual(len(self.window), len(self.window.messages))
+
+        self.window.clear()
+        self.assertEqual(len(self.window), 1)
+        self.assertEqual(self.window.total, 10 + REPLY_PRIMING)
+
+    def test_compact_replaces_oldest_turns(self):
+        self.add_turn(1, assistant("回答 1"))
+        self.add_turn(2, assistant("回答 2"))
+        summary = Message("system", "摘要")
+        summary.tokens = 5
+        saved = self.window.compact([self.window.turns[0]], summary)
+        self.assertEqual(saved, 15)
+        self.assertEqual(self.contents(), ["系统", "摘要", "问题 2", "回答 2"])
+        # 摘要不计入 len, 但计入 counts 与 total
+        self.assertEqual(len(self.window), 3)
+        self.assertEqual(self.window.counts, [10, 5, 10, 10])
+        self.assertEqual(self.window.total, 35 + REPLY_PRIMING)
+
+
+if __name__ == '__main__':
+    unittest.main()
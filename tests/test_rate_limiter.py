@@ -0,0 +1,92 @@
+"""TokenBucket 与 RateLimiter: 补充、扣除与等待时间"""
+
+import unittest
+from unittest import mock
+
+from rate_limiter import RateLimiter, TokenBucket, get_rate_limiter
+
+
+class FakeClock:
+    """可手动推进的 time.monotonic"""
+
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class ClockTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('rate_limiter.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TokenBucketTest(ClockTestCase):
+
+    def test_starts_full(self):
+        bucket = TokenBucket(10, 1)
+        self.assertEqual(bucket.wait_time(10), 0.0)
+
+    def test_wait_time_for_shortfall(self):
+        bucket = TokenBucket(10, 2)
+        bucket.consume(10)
+        self.assertEqual(bucket.wait_time(4), 2.0)
+
+    def test_refill_over_time(self):
+        bucket = TokenBucket(10, 2)
+        bucket.consume(10)
+        self.clock.now += 1.5
+        self.assertEqual(bucket.wait_time(3), 0.0)
+        self.assertEqual(bucket.tokens, 3)
+
+    def test_refill_capped_at_capacity(self):
+        bucket = TokenBucket(10, 2)
+        bucket.consume(4)
+        self.clock.now += 60
+        bucket.wait_time(0)
+        self.assertEqual(bucket.tokens, 10)
+
+
+class RateLimiterTest(ClockTestCase):
+
+    def test_acquire_within_budget(self):
+        limiter = RateLimiter(rpm=60, tpm=600)
+        with mock.patch('rate_limiter.time.sleep') as sleep:
+            limiter.acquire(100)
+        sleep.assert_not_called()
+
+    def test_acquire_waits_for_tokens(self):
+        limiter = RateLimiter(rpm=60, tpm=600)
+        limiter.acquire(600)
+
+        def sleep(seconds):
+            self.clock.now += seconds
+
+        with mock.patch('rate_limiter.time.sleep', side_effect=sleep) as patched:
+            waited = limiter.acquire(100)
+        # 每秒补充 tpm / 60 = 10 个 token
+        patched.assert_called_once_with(10.0)
+        self.assertEqual(waited, 10.0)
+
+    def test_oversized_request_capped_at_capacity(self):
+        limiter = RateLimiter(rpm=60, tpm=600)
+        with mock.patch('rate_limiter.time.sleep') as sleep:
+            limiter.acquire(10_000)
+        sleep.assert_not_called()
+
+
+class GetRateLimiterTest(unittest.TestCase):
+
+    def test_shared_by_name(self):
+        limiter = get_rate_limiter('tests.shared', rpm=10)
+        self.assertIs(get_rate_limiter('tests.shared', rpm=20), limiter)
+        self.assertEqual(limiter.rpm, 10)
+        self.assertIsNot(get_rate_limiter('tests.other'), limiter)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""RetryPolicy: 错误分类、Retry-After 与退避时间"""
+
+import asyncio
+import unittest
+from unittest import mock
+
+import openai
+
+from retry import RetryBudgetExceeded, RetryPolicy
+
+
+class IsRetryableTest(unittest.TestCase):
+
+    def test_retryable_errors(self):
+        for error in (openai.error.RateLimitError("限速"),
+                      openai.error.Timeout("超时"),
+                      openai.error.APIConnectionError("连接失败"),
+                      openai.error.ServiceUnavailableError("服务不可用"),
+                      ConnectionError(),
+                      TimeoutError()):
+            self.assertTrue(RetryPolicy.is_retryable(error), error)
+
+    def test_non_retryable_errors(self):
+        for error in (openai.error.InvalidRequestError("参数有误", param=None),
+                      openai.error.AuthenticationError("密钥无效"),
+                      ValueError("本地错误")):
+            self.assertFalse(RetryPolicy.is_retryable(error), error)
+
+    def test_api_error_by_status(self):
+        self.assertTrue(RetryPolicy.is_retryable(openai.error.APIError("网关错误", http_status=502)))
+        self.assertFalse(RetryPolicy.is_retryable(openai.error.APIError("请求有误", http_status=400)))
+        self.assertTrue(RetryPolicy.is_retryable(openai.error.APIError("未知状态")))
+
+
+class RetryAfterTest(unittest.TestCase):
+
+    @staticmethod
+    def error(headers):
+        return openai.error.RateLimitError("限速", http_status=429, headers=headers)
+
+    def test_milliseconds_first(self):
+        self.assertEqual(RetryPolicy.retry_after(self.error({'retry-after-ms': '1500', 'retry-after': '9'})), 1.5)
+
+    def test_seconds(self):
+        self.assertEqual(RetryPolicy.retry_after(self.error({'retry-after': '3'})), 3.0)
+
+    def test_missing_or_invalid(self):
+        self.assertIsNone(RetryPolicy.retry_after(self.error({})))
+        self.assertIsNone(RetryPolicy.retry_after(self.error({'retry-after': '不是时间'})))
+        self.assertIsNone(RetryPolicy.retry_after(ValueError()))
+
+
+class NextDelayTest(unittest.TestCase):
+
+    def test_exponential_upper_bound(self):
+        policy = RetryPolicy(base_delay=0.5, max_delay=3.0, multiplier=2.0)
+        # 完全抖动: 取上限时即为 min(max_delay, base_delay * multiplier ** n)
+        with mock.patch('retry.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual([policy.next_delay(n) for n in range(4)], [0.5, 1.0, 2.0, 3.0])
+
+    def test_jitter_within_bounds(self):
+        policy = RetryPolicy(base_delay=0.5, max_delay=3.0)
+        for retries in range(6):
+            delay = policy.next_delay(retries)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(3.0, 0.5 * 2 ** retries))
+
+    def test_retry_after_capped(self):
+        policy = RetryPolicy(max_delay=2.0)
+        error = openai.error.RateLimitError("限速", headers={'retry-after': '30'})
+        self.assertEqual(policy.next_delay(0, error), 2.0)
+
+
+class CallTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = RetryPolicy(max_retries=2, base_delay=0, max_elapsed=None)
+
+    def test_retries_then_succeeds(self):
+        func = mock.Mock(side_effect=[openai.error.RateLimitError("限速"), openai.error.Timeout("超时"), "结果"])
+        with mock.patch('retry.time.sleep'):
+            self.assertEqual(self.policy.call(func, 1, key=2), "结果")
+        self.assertEqual(func.call_count, 3)
+        func.assert_called_with(1, key=2)
+
+    def test_non_retryable_raised_immediately(self):
+        func = mock.Mock(side_effect=openai.error.InvalidRequestError("参数有误", param=None))
+        with self.assertRaises(openai.error.InvalidRequestError):
+            self.policy.call(func)
+        self.assertEqual(func.call_count, 1)
+
+    def test_budget_exceeded(self):
+        error = openai.error.RateLimitError("限速")
+        func = mock.Mock(side_effect=error)
+        with mock.patch('retry.time.sleep'), self.assertRaises(RetryBudgetExceeded) as context:
+            self.policy.call(func)
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(context.exception.attempts, 3)
+        self.assertIs(context.exception.last_error, error)
+
+    def test_elapsed_budget(self):
+        policy = RetryPolicy(max_retries=10, max_elapsed=1.0)
+        error = openai.error.RateLimitError("限速", headers={'retry-after': '5'})
+        func = mock.Mock(side_effect=error)
+        with self.assertRaises(RetryBudgetExceeded):
+            policy.call(func)
+        self.assertEqual(func.call_count, 1)
+
+    def test_acall(self):
+        func = mock.AsyncMock(side_effect=[openai.error.APIConnectionError("连接失败"), "结果"])
+        self.assertEqual(asyncio.run(self.policy.acall(func)), "结果")
+        self.assertEqual(func.await_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""SessionStore: 追加、按轮读取与不完整索引的恢复"""
+
+import os
+import tempfile
+import unittest
+
+from session_store import INDEX_FORMAT, SessionStore
+
+
+def user(content):
+    return {"role": "user", "content": content}
+
+
+def assistant(content):
+    return {"role": "assistant", "content": content}
+
+
+class SessionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.store = self.open_store()
+
+    def open_store(self, **kwargs):
+        store = SessionStore(self.root, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def append_turns(self, store, session_id, count, start=1):
+        for number in range(start, start + count):
+            store.append(session_id, user(f"问题 {number}"), tokens=1)
+            store.append(session_id, assistant(f"回答 {number}"), tokens=1)
+
+    @staticmethod
+    def contents(records):
+        return [record["message"]["content"] for record in records]
+
+    def test_load_last_turns(self):
+        self.store.append("s", {"role": "system", "content": "系统"}, tokens=1, pin=True)
+        self.append_turns(self.store, "s", 5)
+        self.assertEqual(self.store.turns("s"), 5)
+        records = self.store.load("s", last_turns=2)
+        self.assertEqual(self.contents(records), ["系统", "问题 4", "回答 4", "问题 5", "回答 5"])
+        self.assertTrue(records[0]["pin"])
+        self.assertEqual(len(self.store.load("s")), 11)
+
+    def test_torn_index_entry_truncated(self):
+        self.append_turns(self.store, "s", 2)
+        self.store.close()
+        # 模拟写入索引项时中途退出
+        with open(os.path.join(self.root, "s.idx"), mode='ab') as f:
+            f.write(b'\x01\x02\x03')
+
+        store = self.open_store()
+        self.assertEqual(self.contents(store.load("s")), ["问题 1", "回答 1", "问题 2", "回答 2"])
+        self.append_turns(store, "s", 1, start=3)
+        self.assertEqual(os.path.getsize(os.path.join(self.root, "s.idx")) % INDEX_FORMAT.size, 0)
+        self.assertEqual(store.turns("s"), 3)
+        self.assertEqual(self.contents(store.load("s", last_turns=1)), ["问题 3", "回答 3"])
+
+    def test_index_shorter_than_one_entry(self):
+        with open(os.path.join(self.root, "s.idx"), mode='wb') as f:
+            f.write(b'\x00' * (INDEX_FORMAT.size - 1))
+        self.assertEqual(self.store.turns("s"), 0)
+        self.assertEqual(self.store.load("s", last_turns=3), [])
+        self.append_turns(self.store, "s", 1)
+        self.assertEqual(self.store.turns("s"), 1)
+
+    def test_reopen_after_eviction(self):
+        store = self.open_store(max_open_writers=1)
+        self.append_turns(store, "a", 2)
+        self.append_turns(store, "b", 1)
+        self.assertEqual(list(store._writers), ["b"])
+        # 再次写入 a 时按索引恢复轮次
+        self.append_turns(store, "a", 1, start=3)
+        self.assertEqual(store.turns("a"), 3)
+        self.assertEqual(self.contents(store.load("a", last_turns=2)), ["问题 2", "回答 2", "问题 3", "回答 3"])
+        self.assertEqual(store.sessions(), ["a", "b"])
+
+    def test_new_segment(self):
+        store = self.open_store(segment_max_bytes=1)
+        self.append_turns(store, "s", 2)
+        self.assertTrue(os.path.exists(store._segment_path("s", 3)))
+        self.assertEqual(self.contents(store.load("s", last_turns=1)), ["问题 2", "回答 2"])
+
+    def test_meta(self):
+        self.assertEqual(self.store.load_meta("s"), {})
+        self.store.save_meta("s", {"total_tokens": 42})
+        self.assertEqual(self.store.load_meta("s"), {"total_tokens": 42})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""StreamAssembler: 按 choice 拼接"流式输出"的增量"""
+
+import unittest
+
+from stream_assembler import StreamAssembler
+
+
+def chunk(index=0, finish_reason=None, **delta):
+    return {"choices": [{"index": index, "delta": delta, "finish_reason": finish_reason}]}
+
+
+class StreamAssemblerTest(unittest.TestCase):
+
+    def test_content(self):
+        assembler = StreamAssembler()
+        deltas = assembler.feed(chunk(role="assistant", content=""))
+        self.assertEqual(deltas[0].role, "assistant")
+        for piece in ("你", "好", "!"):
+            self.assertEqual(assembler.feed(chunk(content=piece))[0].content, piece)
+        self.assertFalse(assembler.finished)
+        assembler.feed(chunk(finish_reason="stop"))
+
+        self.assertTrue(assembler.finished)
+        self.assertEqual(assembler.chunks, 5)
+        self.assertEqual(assembler.message(), {"role": "assistant", "content": "你好!"})
+        self.assertEqual(assembler.choices[0].finish_reason, "stop")
+
+    def test_function_call(self):
+        assembler = StreamAssembler()
+        assembler.feed(chunk(role="assistant", content=None,
+                             function_call={"name": "get_weather", "arguments": ""}))
+        for piece in ('{"city"', ': "北京"', '}'):
+            assembler.feed(chunk(function_call={"arguments": piece}))
+        assembler.feed(chunk(finish_reason="function_call"))
+        self.assertEqual(assembler.message(), {
+            "role": "assistant", "content": None,
+            "function_call": {"name": "get_weather", "arguments": '{"city": "北京"}'}})
+
+    def test_interleaved_choices(self):
+        assembler = StreamAssembler()
+        for index, piece in [(0, "a"), (1, "x"), (0, "b"), (1, "y"), (1, "z")]:
+            assembler.feed(chunk(index=index, content=piece))
+        assembler.feed(chunk(index=1, finish_reason="stop"))
+        self.assertFalse(assembler.finished)
+        assembler.feed(chunk(index=0, finish_reason="length"))
+
+        self.assertTrue(assembler.finished)
+        self.assertEqual([message["content"] for message in assembler.messages()], ["ab", "xyz"])
+        self.assertEqual(assembler.choices[0].finish_reason, "length")
+
+    def test_joined_content_refreshed_after_feed(self):
+        assembler = StreamAssembler()
+        assembler.feed(chunk(content="a"))
+        self.assertEqual(assembler.choices[0].content, "a")
+        assembler.feed(chunk(content="b"))
+        self.assertEqual(assembler.choices[0].content, "ab")
+
+    def test_whole_response_as_one_chunk(self):
+        assembler = StreamAssembler()
+        assembler.feed({"choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": "完整回复"}}]})
+        self.assertTrue(assembler.finished)
+        self.assertEqual(assembler.message(), {"role": "assistant", "content": "完整回复"})
+
+    def test_empty(self):
+        assembler = StreamAssembler()
+        self.assertEqual(assembler.feed({"choices": []}), [])
+        self.assertIsNone(assembler.message())
+        self.assertEqual(assembler.messages(), [])
+        self.assertFalse(assembler.finished)
+
+
+if __name__ == '__main__':
+    unittest.main()
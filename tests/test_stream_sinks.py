@@ -0,0 +1,144 @@
+"""coalesce 与接收端: 按 choice 合并、背压与分发"""
+
+import asyncio
+import io
+import unittest
+
+from stream_assembler import StreamDelta
+from stream_sinks import AsyncSink, CallbackSink, StreamDispatcher, StreamEnd, StreamSink, TextSink, coalesce
+
+
+def delta(index=0, content=None, role=None, finish_reason=None, function_name=None, arguments=None):
+    return StreamDelta(index, role, content, function_name, arguments, finish_reason)
+
+
+def chunk(index=0, finish_reason=None, **fields):
+    return {"choices": [{"index": index, "delta": fields, "finish_reason": finish_reason}]}
+
+
+class CoalesceTest(unittest.TestCase):
+
+    def test_merges_same_choice(self):
+        merged = coalesce([delta(content="a", role="assistant"), delta(content="b"), delta(content="c")])
+        self.assertEqual(merged, [delta(content="abc", role="assistant")])
+
+    def test_merges_interleaved_choices(self):
+        merged = coalesce([delta(0, "a"), delta(1, "x"), delta(0, "b"), delta(1, "y"), delta(0, "c")])
+        self.assertEqual(merged, [delta(0, "abc"), delta(1, "xy")])
+
+    def test_keeps_finish_reason(self):
+        merged = coalesce([delta(content="a"), delta(content="b", finish_reason="stop")])
+        self.assertEqual(merged, [delta(content="ab", finish_reason="stop")])
+
+    def test_no_merge_after_finish_reason(self):
+        events = [delta(content="a", finish_reason="stop"), delta(content="b")]
+        self.assertEqual(coalesce(events), events)
+
+    def test_no_merge_across_stream_end(self):
+        end = StreamEnd([], None)
+        events = [delta(content="a"), end, delta(content="b")]
+        self.assertEqual(coalesce(events), events)
+
+    def test_function_call_arguments(self):
+        merged = coalesce([delta(function_name="get_weather", arguments=""),
+                           delta(arguments='{"city"'), delta(arguments=': "北京"}')])
+        self.assertEqual(merged, [delta(function_name="get_weather", arguments='{"city": "北京"}')])
+
+
+class BackpressureTest(unittest.TestCase):
+
+    class PausedSink(StreamSink):
+        """不处理事件, 只观察缓冲区"""
+
+        def _wake(self):
+            pass
+
+        def join(self, timeout=None):
+            return True
+
+        async def wait_closed(self):
+            pass
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            StreamSink()
+
+    def test_invalid_overflow(self):
+        with self.assertRaises(ValueError):
+            self.PausedSink(overflow='block')
+
+    def test_coalesce_never_drops(self):
+        sink = self.PausedSink(max_pending=4, overflow='coalesce')
+        for i in range(10):
+            sink.write([delta(i % 2, str(i))])
+        self.assertEqual(sink.dropped, 0)
+        self.assertLess(len(sink._pending), 10)
+        # 合并后每个 choice 的内容与顺序不变
+        for index, expected in ((0, "02468"), (1, "13579")):
+            self.assertEqual(''.join(event.content for event in sink._pending if event.index == index), expected)
+
+    def test_drop_keeps_stream_end(self):
+        sink = self.PausedSink(max_pending=2, overflow='drop')
+        sink.write([delta(content="a"), delta(content="b")])
+        sink.close()
+        sink.write([delta(content="c")])
+        self.assertEqual(sink.dropped, 2)
+        self.assertEqual(sink._pending, [StreamEnd([], None), delta(content="c")])
+
+
+class DispatcherTest(unittest.TestCase):
+
+    def test_threaded_sinks(self):
+        text = io.StringIO()
+        batches = []
+        ends = []
+        dispatcher = StreamDispatcher([TextSink(file=text), CallbackSink(batches.append, ends.append)])
+        dispatcher.feed(chunk(role="assistant", content=""))
+        for piece in ("你", "好"):
+            dispatcher.feed(chunk(content=piece))
+        dispatcher.feed(chunk(finish_reason="stop"))
+        end = dispatcher.close()
+
+        self.assertEqual(text.getvalue(), "你好")
+        self.assertEqual(end.messages, [{"role": "assistant", "content": "你好"}])
+        self.assertEqual(ends, [end])
+        self.assertEqual(sum(len(batch) for batch in batches), 4)
+        # 重复结束不会再次分发
+        self.assertIs(dispatcher.close(), end)
+        self.assertEqual(ends, [end])
+
+    def test_failing_sink_does_not_affect_others(self):
+        def fail(batch):
+            raise RuntimeError("接收端出错")
+
+        text = io.StringIO()
+        dispatcher = StreamDispatcher([CallbackSink(fail), TextSink(file=text)])
+        with self.assertLogs('logger', level='WARNING'):
+            dispatcher.feed(chunk(content="a"))
+            dispatcher.close()
+        self.assertEqual(text.getvalue(), "a")
+
+    def test_async_sink(self):
+        async def main():
+            received = []
+            ends = []
+
+            async def on_batch(batch):
+                received.extend(event.content for event in batch)
+
+            async def on_end(end):
+                ends.append(end)
+
+            dispatcher = StreamDispatcher([AsyncSink(on_batch, on_end)])
+            for piece in ("a", "b", "c"):
+                dispatcher.feed(chunk(content=piece))
+            end = await dispatcher.aclose()
+            return received, ends, end
+
+        received, ends, end = asyncio.run(main())
+        self.assertEqual(''.join(received), "abc")
+        self.assertEqual(ends, [end])
+
+
+if __name__ == '__main__':
+    unittest.main()
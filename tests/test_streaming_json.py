@@ -0,0 +1,79 @@
+"""IncrementalJSONParser: 逐片段解析函数参数"""
+
+import json
+import unittest
+
+from streaming_json import IncrementalJSONParser, StreamingJSONError
+
+ARGUMENTS = '{"city": "北\\"京", "days": 3, "units": ["c", {"k": [1, 2]}], "ok": true, "note": null, "t": -1.5}'
+
+
+class IncrementalJSONParserTest(unittest.TestCase):
+
+    def parse(self, fragments):
+        parser = IncrementalJSONParser()
+        completed = []
+        for fragment in fragments:
+            completed.extend(parser.feed(fragment))
+        return parser, completed
+
+    def test_whole_text(self):
+        parser, completed = self.parse([ARGUMENTS])
+        self.assertTrue(parser.done)
+        self.assertEqual(parser.close(), json.loads(ARGUMENTS))
+        self.assertEqual([key for key, _ in completed], ["city", "days", "units", "ok", "note", "t"])
+        self.assertEqual(parser.position, len(ARGUMENTS))
+
+    def test_every_split(self):
+        expected = json.loads(ARGUMENTS)
+        for size in (1, 2, 3, 7):
+            fragments = [ARGUMENTS[i:i + size] for i in range(0, len(ARGUMENTS), size)]
+            parser, completed = self.parse(fragments)
+            self.assertEqual(parser.close(), expected, size)
+            self.assertEqual(dict(completed), expected, size)
+
+    def test_value_reported_when_complete(self):
+        parser = IncrementalJSONParser()
+        self.assertEqual(parser.feed('{"a": "x'), [])
+        self.assertEqual(parser.feed('y", "b": 1'), [("a", "xy")])
+        # 数字在遇到 ',' '}' 或空白之前可能还没有结束
+        self.assertEqual(parser.feed('2}'), [("b", 12)])
+        self.assertTrue(parser.done)
+
+    def test_empty_object(self):
+        parser, completed = self.parse([' { ', '} '])
+        self.assertEqual(parser.close(), {})
+        self.assertEqual(completed, [])
+
+    def test_incomplete(self):
+        parser, _ = self.parse(['{"a": 1, "b": [1, 2'])
+        self.assertFalse(parser.done)
+        self.assertEqual(parser.result, {"a": 1})
+        with self.assertRaises(StreamingJSONError):
+            parser.close()
+
+    def test_malformed(self):
+        cases = [
+            ('[1, 2]', 0),              # 不是对象
+            ('{"a" 1}', 5),             # 缺少 ':'
+            ('{"a": x}', 6),            # 非法的值
+            ('{"a": 1 "b": 2}', 8),     # 缺少 ','
+            ('{"a": [1}', 8),           # 括号不匹配
+            ('{"a": 1,}', 8),           # ',' 之后缺少键
+            ('{"a": 1} {', 9),          # 多余的内容
+        ]
+        for text, position in cases:
+            with self.assertRaises(StreamingJSONError, msg=text) as context:
+                self.parse([text])
+            self.assertEqual(context.exception.position, position, text)
+            self.assertIsInstance(context.exception, ValueError)
+
+    def test_malformed_value_detected_early(self):
+        parser = IncrementalJSONParser()
+        with self.assertRaises(StreamingJSONError):
+            # 后面还没到达, 错误的值在结束时即可发现
+            parser.feed('{"a": tru,')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+"""parse_calls 与 ToolExecutor: 展开并行调用, 每个调用都有结果"""
+
+import threading
+import time
+import unittest
+
+from tool_executor import PARALLEL_FUNCTION, FunctionCall, ToolExecutor, parse_calls
+
+
+def parallel(*tool_uses):
+    return parse_calls(PARALLEL_FUNCTION, {"tool_uses": list(tool_uses)})
+
+
+class ParseCallsTest(unittest.TestCase):
+
+    def test_single_call(self):
+        self.assertEqual(parse_calls("get_weather", {"city": "北京"}), [FunctionCall("get_weather", {"city": "北京"})])
+        self.assertEqual(parse_calls("now", None), [FunctionCall("now", {})])
+
+    def test_parallel(self):
+        calls = parallel({"recipient_name": "functions.get_weather", "parameters": {"city": "北京"}},
+                         {"recipient_name": "now"})
+        self.assertEqual(calls, [FunctionCall("get_weather", {"city": "北京"}), FunctionCall("now", {})])
+
+    def test_empty_tool_uses(self):
+        for arguments in ({}, {"tool_uses": []}, {"tool_uses": "get_weather"}, "不是 dict"):
+            calls = parse_calls(PARALLEL_FUNCTION, arguments)
+            self.assertEqual(len(calls), 1, arguments)
+            self.assertEqual(calls[0].name, PARALLEL_FUNCTION)
+            self.assertIsNotNone(calls[0].error)
+
+    def test_malformed_items(self):
+        calls = parallel("get_weather",
+                         {"recipient_name": "functions.get_weather", "parameters": ["北京"]},
+                         {"parameters": {}},
+                         {"recipient_name": "functions.now"})
+        self.assertEqual([call.name for call in calls], [PARALLEL_FUNCTION, "get_weather", PARALLEL_FUNCTION, "now"])
+        self.assertIn("第 1 个调用", calls[0].error)
+        self.assertIn("参数应为 dict", calls[1].error)
+        self.assertIsNone(calls[3].error)
+
+    def test_non_dict_arguments(self):
+        [call] = parse_calls("get_weather", "北京")
+        self.assertIn("参数应为 dict", call.error)
+
+
+class ToolExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = ToolExecutor(max_workers=2, timeout=5)
+        self.addCleanup(self.executor.close)
+        self.repository = {
+            "get_weather": lambda city: {"city": city, "weather": "晴"},
+            "echo": lambda text: text,
+            "fail": self.fail_function,
+        }
+
+    @staticmethod
+    def fail_function():
+        raise ValueError("出错了")
+
+    def test_results_in_order(self):
+        messages = self.executor.run([FunctionCall("echo", {"text": "a"}),
+                                      FunctionCall("get_weather", {"city": "北京"}),
+                                      FunctionCall("echo", {"text": "b"})], self.repository)
+        self.assertEqual([message["name"] for message in messages], ["echo", "get_weather", "echo"])
+        self.assertEqual([message["content"] for message in messages],
+                         ["a", '{"city": "北京", "weather": "晴"}', "b"])
+        self.assertTrue(all(message["role"] == "function" for message in messages))
+
+    def test_every_call_gets_a_reply(self):
+        calls = parallel({"recipient_name": "functions.echo", "parameters": {"text": "a"}},
+                         {"recipient_name": "functions.missing"},
+                         "坏的调用",
+                         {"recipient_name": "functions.fail"})
+        with self.assertLogs('logger', level='WARNING'):
+            messages = self.executor.run(calls, self.repository)
+        self.assertEqual(len(messages), 4)
+        self.assertEqual(messages[0]["content"], "a")
+        self.assertEqual(messages[1]["content"], "函数 missing 不存在")
+        self.assertIn("调用有误", messages[2]["content"])
+        self.assertEqual(messages[3]["content"], "函数 fail 执行失败: 出错了")
+
+    def test_single_call_runs_inline(self):
+        caller = []
+        self.repository["where"] = lambda: caller.append(threading.current_thread()) or "ok"
+        self.assertEqual(self.executor.run([FunctionCall("where", {})], self.repository)[0]["content"], "ok")
+        self.assertEqual(caller, [threading.current_thread()])
+
+    def test_shared_deadline(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.repository["hang"] = lambda: release.wait(5)
+        self.executor.timeout = 0.05
+        with self.assertLogs('logger', level='WARNING'):
+            messages = self.executor.run([FunctionCall("echo", {"text": "a"}), FunctionCall("hang", {})],
+                                         self.repository)
+        self.assertEqual(messages[0]["content"], "a")
+        self.assertIn("执行失败", messages[1]["content"])
+
+    def test_close_cancels_queued_calls(self):
+        executor = ToolExecutor(max_workers=1)
+        started = threading.Event()
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def block():
+            started.set()
+            release.wait(5)
+            return "done"
+
+        self.repository["block"] = block
+        result = []
+        thread = threading.Thread(target=lambda: result.extend(
+            executor.run([FunctionCall("block", {}), FunctionCall("echo", {"text": "a"})], self.repository)))
+        thread.start()
+        self.assertTrue(started.wait(5))
+        # 等待第二个调用提交到线程池 (排在 block 之后)
+        deadline = time.monotonic() + 5
+        while len(executor._futures) < 2 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        executor.close()
+        release.set()
+        thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(result[0]["content"], "done")
+        self.assertIn("执行器已关闭", result[1]["content"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,271 @@
+"""按接口的实际格式计算对话的 token 数
+
+str(messages) 计算的是 Python 字典的标点, 与接口实际计费的格式不同.
+这里按对话格式计算: 每条消息的格式开销、name 字段、函数调用消息,
+以及 functions 描述 (接口内部会将其转换为 TypeScript 风格的声明后计入提示).
+
+批量接口: 将大量文本/对话的所有字段合并后一次交给 encode_batch 多线程编码,
+用于离线估算 JSON Lines 语料 (如 requests.jsonl) 的费用:
+    python token_counter.py requests.jsonl --model gpt-3.5-turbo --price 0.0015
+"""
+
+import argparse
+import json
+
+from tokenizer_registry import default_tokenizers
+
+# 每次回复前接口会加入 <|start|>assistant<|message|>
+REPLY_PRIMING = 3
+# 提供 functions 时的固定开销
+FUNCTIONS_OVERHEAD = 9
+# 同时存在 system 消息与 functions 时, 两者合并后节省的 token 数
+SYSTEM_WITH_FUNCTIONS_SAVING = 4
+
+
+def _message_format(model):
+    """(每条消息的格式开销, name 字段的开销)"""
+    if model.startswith('gpt-3.5-turbo-0301'):
+        return 4, -1
+    return 3, 1
+
+
+def _components(message):
+    """消息中会被编码的字段 (CLChat 中简化的函数调用消息同样适用)"""
+    function_call = message.get('function_call') or {}
+    values = [message.get('role'), message.get('content'), message.get('name'),
+              function_call.get('name') or message.get('function_name'),
+              function_call.get('arguments') or message.get('function_args')]
+    return [value for value in values if isinstance(value, str) and value]
+
+
+def _message_overhead(message, model):
+    per_message, per_name = _message_format(model)
+    tokens = per_message
+    if message.get('name'):
+        tokens = tokens + per_name
+    # 函数返回消息的格式比一般消息短
+    if message.get('role') == 'function':
+        tokens = tokens - 2
+    # 函数调用消息的额外开销
+    if message.get('function_call') or message.get('function_name'):
+        tokens = tokens + 3
+    return tokens
+
+
+def _format_type(param, indent):
+    param_type = param.get('type')
+    if param_type == 'string':
+        if param.get('enum'):
+            return ' | '.join(f'"{value}"' for value in param['enum'])
+        return 'string'
+    if param_type in ('number', 'integer'):
+        if param.get('enum'):
+            return ' | '.join(str(value) for value in param['enum'])
+        return 'number'
+    if param_type == 'boolean':
+        return 'boolean'
+    if param_type == 'null':
+        return 'null'
+    if param_type == 'object':
+        return '\n'.join(['{', _format_properties(param, indent + 2), '}'])
+    if param_type == 'array':
+        if param.get('items'):
+            return f"{_format_type(param['items'], indent)}[]"
+        return 'any[]'
+    return 'any'
+
+
+def _format_properties(schema, indent):
+    required = schema.get('required') or []
+    lines = []
+    for name, param in (schema.get('properties') or {}).items():
+        if param.get('description') and indent < 2:
+            lines.append(f"// {param['description']}")
+        optional = '' if name in required else '?'
+        lines.append(f"{name}{optional}: {_format_type(param, indent)},")
+    return '\n'.join(' ' * indent + line for line in lines)
+
+
+def format_functions(functions):
+    """将 functions 描述转换为接口内部使用的 TypeScript 风格声明"""
+    lines = ['namespace functions {', '']
+    for function in functions:
+        if function.get('description'):
+            lines.append(f"// {function['description']}")
+        parameters = function.get('parameters') or {}
+        if parameters.get('properties'):
+            lines.append(f"type {function['name']} = (_: {{")
+            lines.append(_format_properties(parameters, 0))
+            lines.append('}) => any;')
+        else:
+            lines.append(f"type {function['name']} = () => any;")
+        lines.append('')
+    lines.append('} // namespace functions')
+    return '\n'.join(lines)
+
+
+def _encode(encoder, text):
+    # 语料中可能出现 <|endoftext|> 等特殊标记, 按普通文本计算
+    return encoder.encode(text, disallowed_special=())
+
+
+def count_text(text, model='gpt-3.5-turbo-16k-0613'):
+    """计算一段文本的 token 数"""
+    return len(_encode(default_tokenizers.get(model), text))
+
+
+def count_message(message, model='gpt-3.5-turbo-16k-0613'):
+    """计算一条消息的 token 数 (包括格式开销)"""
+    encoder = default_tokenizers.get(model)
+    return _message_overhead(message, model) + sum(len(_encode(encoder, value))
+                                                   for value in _components(message))
+
+
+def count_functions(functions, model='gpt-3.5-turbo-16k-0613'):
+    """计算 functions 描述的 token 数"""
+    if not functions:
+        return 0
+    return count_text(format_functions(functions), model) + FUNCTIONS_OVERHEAD
+
+
+def _chat_adjustment(messages, functions):
+    """对话整体的开销: 回复前缀, 以及 system 消息与 functions 同时存在时的修正"""
+    tokens = REPLY_PRIMING
+    if functions:
+        system = [message for message in messages if message.get('role') == 'system']
+        if system:
+            # 接口会在第一条 system 消息后加入换行, 再与 functions 描述合并
+            tokens = tokens + 1 - SYSTEM_WITH_FUNCTIONS_SAVING
+    return tokens
+
+
+def count_chat(messages, functions=None, model='gpt-3.5-turbo-16k-0613'):
+    """计算一次请求的提示 token 数 (与接口返回的 usage.prompt_tokens 对应)
+
+    :param messages: 消息列表
+    :param functions: 函数描述列表
+    :param model: 模型名称
+    :return: token 数
+    """
+    tokens = sum(count_message(message, model) for message in messages)
+    return tokens + count_functions(functions, model) + _chat_adjustment(messages, functions)
+
+
+# ===== 批量接口 =====
+def count_texts(texts, model='gpt-3.5-turbo-16k-0613', num_threads=8):
+    """批量计算文本的 token 数 (多线程编码)
+
+    :param texts: 文本列表
+    :param model: 模型名称
+    :param num_threads: 编码线程数
+    :return: 与 texts 一一对应的 token 数列表
+    """
+    encoder = default_tokenizers.get(model)
+    encoded = encoder.encode_batch(list(texts), num_threads=num_threads, disallowed_special=())
+    return [len(tokens) for tokens in encoded]
+
+
+def count_chats(conversations, functions=None, model='gpt-3.5-turbo-16k-0613', num_threads=8):
+    """批量计算对话的提示 token 数
+
+    所有对话中需要编码的字段合并为一个列表, 只调用一次 encode_batch.
+
+    :param conversations: 对话列表, 每个对话为消息列表
+    :param functions: 所有对话共用的函数描述列表
+    :param model: 模型名称
+    :param num_threads: 编码线程数
+    :return: 与 conversations 一一对应的 token 数列表
+    """
+    conversations = list(conversations)
+    return _count_chats(conversations, [functions] * len(conversations), model, num_threads)
+
+
+def _count_chats(conversations, functions_list, model, num_threads):
+    texts = []
+    for messages in conversations:
+        for message in messages:
+            texts.extend(_components(message))
+    counts = iter(count_texts(texts, model, num_threads))
+
+    # 相同的函数描述只计算一次
+    functions_tokens = {}
+    results = []
+    for messages, functions in zip(conversations, functions_list):
+        key = json.dumps(functions, sort_keys=True) if functions else ''
+        if key not in functions_tokens:
+            functions_tokens[key] = count_functions(functions, model)
+        tokens = functions_tokens[key] + _chat_adjustment(messages, functions)
+        for message in messages:
+            tokens = tokens + _message_overhead(message, model)
+            for _ in _components(message):
+                tokens = tokens + next(counts)
+        results.append(tokens)
+    return results
+
+
+def count_jsonl(path, fields=None, model='gpt-3.5-turbo-16k-0613', batch_size=1000, num_threads=8):
+    """逐批计算 JSON Lines 文件中每条记录的 token 数
+
+    含有 messages 字段的记录按对话计算 (同时计入其 functions), 其余记录计算 fields 指定的字段
+    (为空时计算所有字符串字段).
+
+    :param path: 文件路径
+    :param fields: 需要计算的字段列表
+    :param model: 模型名称
+    :param batch_size: 每批记录数
+    :param num_threads: 编码线程数
+    :return: 与记录一一对应的 token 数列表
+    """
+    results = []
+
+    def flush(batch):
+        counts = [0] * len(batch)
+        chats = [i for i, record in enumerate(batch) if isinstance(record.get('messages'), list)]
+        texts = [i for i, record in enumerate(batch) if not isinstance(record.get('messages'), list)]
+
+        chat_counts = _count_chats([batch[i]['messages'] for i in chats],
+                                   [batch[i].get('functions') for i in chats], model, num_threads)
+        for i, tokens in zip(chats, chat_counts):
+            counts[i] = tokens
+
+        values = []
+        for i in texts:
+            keys = fields or [key for key, value in batch[i].items() if isinstance(value, str)]
+            values.append('\n'.join(str(batch[i].get(key, '')) for key in keys))
+        for i, tokens in zip(texts, count_texts(values, model, num_threads)):
+            counts[i] = tokens
+        results.extend(counts)
+
+    with open(path, mode='r', encoding='utf-8') as f:
+        batch = []
+        for line in f:
+            if not line.strip():
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="离线估算 JSON Lines 语料的 token 数与费用")
+    parser.add_argument('path', help="JSON Lines 文件")
+    parser.add_argument('--model', default='gpt-3.5-turbo-16k-0613')
+    parser.add_argument('--fields', nargs='*', help="需要计算的字段, 默认为所有字符串字段")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--price', type=float, default=0.0, help="每 1000 token 的价格 (美元)")
+    args = parser.parse_args()
+
+    counts = count_jsonl(args.path, fields=args.fields, model=args.model, batch_size=args.batch_size,
+                         num_threads=args.threads)
+    total = sum(counts)
+    print(f" 记录数: {len(counts)}")
+    print(f" Token 总数: {total}")
+    if counts:
+        print(f" 平均每条: {total / len(counts):.1f}, 最多: {max(counts)}")
+    if args.price:
+        print(f" 估算费用: ${total / 1000 * args.price:.4f}")
@@ -0,0 +1,116 @@
+"""进程内共享的编码器 (tokenizer) 注册表
+
+按模型名称缓存 tiktoken 编码器, 避免在"流式输出"等热路径上反复查找;
+加载 BPE 词表较慢, 可在后台线程中预热 (例如在命令行等待用户首次输入时).
+tiktoken 不认识的模型名称按前缀查找备用编码, 仍找不到时使用 cl100k_base.
+
+使用方式:
+    from tokenizer_registry import default_tokenizers
+    default_tokenizers.warm(["gpt-3.5-turbo-16k-0613"])   # 后台预热
+    encoder = default_tokenizers.get("gpt-3.5-turbo-16k-0613")
+"""
+
+import threading
+
+import tiktoken
+
+from logger import logger
+
+# tiktoken 不认识的模型名称: 按前缀选择编码 (长前缀优先)
+FALLBACK_ENCODINGS = {
+    "gpt-4o": "o200k_base",
+    "gpt-4": "cl100k_base",
+    "gpt-3.5-turbo": "cl100k_base",
+    "gpt-35-turbo": "cl100k_base",
+    "text-embedding-3": "cl100k_base",
+    "text-embedding-ada-002": "cl100k_base",
+    "ft:gpt-4": "cl100k_base",
+    "ft:gpt-3.5-turbo": "cl100k_base",
+    "text-davinci-003": "p50k_base",
+    "text-davinci-002": "p50k_base",
+    "code-davinci": "p50k_base",
+    "davinci": "r50k_base",
+}
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+class TokenizerRegistry:
+    """ 编码器注册表 (线程安全)
+
+    属性:
+    - fallbacks (dict): 模型名称前缀与备用编码名称的对应表
+    - default_encoding (str): 都找不到时使用的编码名称
+
+    方法:
+    - encoding_name : 获取模型对应的编码名称
+    - get : 获取模型对应的编码器 (已缓存)
+    - warm : 预热编码器 (默认在后台线程中进行)
+    """
+
+    def __init__(self, fallbacks=None, default_encoding=DEFAULT_ENCODING):
+        self.fallbacks = dict(FALLBACK_ENCODINGS if fallbacks is None else fallbacks)
+        self.default_encoding = default_encoding
+        # 模型名称 -> 编码器
+        self._encoders = {}
+        self._lock = threading.Lock()
+
+    def encoding_name(self, model):
+        """获取模型对应的编码名称 (只查表, 不加载编码)"""
+        try:
+            return tiktoken.encoding_name_for_model(model)
+        except KeyError:
+            pass
+        for prefix in sorted(self.fallbacks, key=len, reverse=True):
+            if model.startswith(prefix):
+                return self.fallbacks[prefix]
+        return self.default_encoding
+
+    def get(self, model):
+        """获取模型对应的编码器, 首次获取时加载并缓存"""
+        encoder = self._encoders.get(model)
+        if encoder is not None:
+            return encoder
+
+        # 同一时间只加载一次 (其余线程等待并复用加载结果)
+        with self._lock:
+            encoder = self._encoders.get(model)
+            if encoder is None:
+                encoder = self._load(model)
+                self._encoders[model] = encoder
+        return encoder
+
+    def _load(self, model):
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            name = self.encoding_name(model)
+            logger.debug("tiktoken 不认识模型 %s, 使用备用编码 %s", model, name)
+            return tiktoken.get_encoding(name)
+
+    def warm(self, models, background=True):
+        """预热编码器
+
+        :param models: 模型名称列表
+        :param background: 是否在后台线程中进行, 为 True 时返回该线程
+        :return: threading.Thread 或 None
+        """
+
+        def load_all():
+            for model in models:
+                try:
+                    self.get(model)
+                except Exception as e:
+                    # 预热失败不影响使用, 首次使用时会再次尝试
+                    logger.warning("预热编码器失败(%s): %s", model, e)
+
+        if not background:
+            load_all()
+            return None
+        thread = threading.Thread(target=load_all, name='tokenizer-warmup', daemon=True)
+        thread.start()
+        return thread
+
+
+# 默认的编码器注册表
+default_tokenizers = TokenizerRegistry()
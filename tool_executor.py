@@ -0,0 +1,190 @@
+"""在线程池中并行执行函数调用
+
+原本 CLChat.function_callback 每次只同步执行一个函数. 模型一次请求多个互不依赖的函数时
+(0613 系列模型会以 multi_tool_use.parallel 的形式一次返回多个函数调用), 这里在线程池中并行执行,
+按请求的顺序收集结果; 所有函数的结果加入上下文后只再调用一次模型, 同时减少等待时间与往返次数.
+
+multi_tool_use.parallel 的参数格式:
+    {"tool_uses": [{"recipient_name": "functions.<函数名>", "parameters": {...}}, ...]}
+
+使用方式:
+    calls = parse_calls(function_name, arguments)
+    function_messages = default_tool_executor.run(calls, function_repository)
+"""
+
+import json
+import threading
+from collections import namedtuple
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError, wait
+
+from logger import logger
+
+# 模型用于一次请求多个函数的伪函数名
+PARALLEL_FUNCTION = 'multi_tool_use.parallel'
+
+# 一次函数调用: 函数名与参数 (dict); 调用的格式有误时 error 为错误信息 (作为该调用的结果, 不执行)
+FunctionCall = namedtuple('FunctionCall', ['name', 'arguments', 'error'], defaults=(None,))
+
+
+def parse_calls(function_name, arguments):
+    """将模型的函数调用整理为 FunctionCall 列表 (展开 multi_tool_use.parallel)
+
+    格式有误的调用 (tool_uses 为空, 其中的项或参数不是 dict) 不抛出异常, 而是带上 error 返回,
+    由执行器将错误信息作为该调用的结果, 其余调用照常执行.
+
+    :param function_name: 函数名
+    :param arguments: 已解析的参数 (dict)
+    """
+    if function_name != PARALLEL_FUNCTION:
+        return [_checked_call(function_name, arguments)]
+    tool_uses = arguments.get('tool_uses') if isinstance(arguments, dict) else None
+    if not tool_uses or not isinstance(tool_uses, list):
+        return [FunctionCall(PARALLEL_FUNCTION, arguments, "tool_uses 为空或不是列表")]
+    calls = []
+    for number, tool_use in enumerate(tool_uses, start=1):
+        if not isinstance(tool_use, dict):
+            calls.append(FunctionCall(PARALLEL_FUNCTION, tool_use, f"第 {number} 个调用应为 dict: {tool_use!r}"))
+            continue
+        name = str(tool_use.get('recipient_name') or '')
+        if name.startswith('functions.'):
+            name = name[len('functions.'):]
+        calls.append(_checked_call(name or PARALLEL_FUNCTION, tool_use.get('parameters')))
+    return calls
+
+
+def _checked_call(name, arguments):
+    """参数为空时视为 {}, 不是 dict 时带上错误信息"""
+    if arguments is None:
+        arguments = {}
+    if not isinstance(arguments, dict):
+        return FunctionCall(name, arguments, f"参数应为 dict: {arguments!r}")
+    return FunctionCall(name, arguments)
+
+
+def _to_content(result):
+    """函数的返回值转换为消息内容 (str)"""
+    if isinstance(result, str):
+        return result
+    return json.dumps(result, ensure_ascii=False, default=str)
+
+
+class ToolExecutor:
+    """ 函数调用的执行器 (线程池)
+
+    超时只是不再等待: 已在运行的函数无法中止, 会继续占用线程池的线程直至返回.
+    挂起的函数因此会减少可用的线程, 多个会话共用 default_tool_executor 时也会影响其他会话;
+    需要隔离时为每个会话创建各自的 ToolExecutor.
+
+    属性:
+    - max_workers (int): 线程池的线程数
+    - timeout (float): 一组并行调用的总超时时间 (秒, 所有函数共用一个截止时间), 为空时不限;
+      超时或出错时以错误信息作为该函数的结果. 只有一个调用时在当前线程中执行, 不设超时
+
+    方法:
+    - run : 执行一组函数调用, 按顺序返回函数消息
+    - close : 关闭线程池
+    """
+
+    def __init__(self, max_workers=4, timeout=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        # 已提交、尚未完成的调用 (关闭时取消)
+        self._futures = set()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='tool')
+            return self._executor
+
+    def run(self, calls, repository):
+        """执行一组函数调用, 按请求的顺序返回函数消息 ({"role": "function", "name", "content"})
+
+        格式有误或函数库中没有的调用不执行, 以错误信息作为其结果; 只有一个可执行的调用时直接在当前线程中执行.
+
+        :param calls: FunctionCall 列表
+        :param repository: 函数库 (函数名与函数的对应)
+        """
+        messages = [None] * len(calls)
+        runnable = []
+        for i, call in enumerate(calls):
+            if call.error is not None:
+                logger.warning("函数调用 %s 格式有误: %s", call.name, call.error)
+                messages[i] = self._reply(call, f"函数 {call.name} 调用有误: {call.error}")
+            elif call.name not in repository:
+                logger.warning("函数 %s 不存在", call.name)
+                messages[i] = self._reply(call, f"函数 {call.name} 不存在")
+            else:
+                runnable.append(i)
+
+        if len(runnable) == 1:
+            call = calls[runnable[0]]
+            messages[runnable[0]] = self._message(call, self._execute, repository[call.name], call.arguments)
+        elif runnable:
+            pool = self._pool()
+            futures = {i: self._submit(pool, repository[calls[i].name], calls[i].arguments) for i in runnable}
+            logger.debug("并行执行 %s 个函数: %s", len(runnable), [calls[i].name for i in runnable])
+            # 所有函数共用一个截止时间
+            _, not_done = wait(futures.values(), timeout=self.timeout)
+            for future in not_done:
+                # 尚未开始的不再执行; 已在运行的无法中止, 执行完后丢弃结果
+                future.cancel()
+            for i, future in futures.items():
+                messages[i] = self._message(calls[i], self._result, future, future in not_done)
+        return messages
+
+    def _submit(self, pool, function, arguments):
+        future = pool.submit(function, **arguments)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    @staticmethod
+    def _execute(function, arguments):
+        return function(**arguments)
+
+    def _result(self, future, timed_out):
+        if timed_out:
+            raise TimeoutError(f"超过 {self.timeout} 秒")
+        try:
+            return future.result()
+        except CancelledError:
+            # 执行器已关闭 (close), 尚未开始的调用被取消
+            raise RuntimeError("执行器已关闭, 未执行") from None
+
+    @classmethod
+    def _message(cls, call, method, *args):
+        try:
+            content = _to_content(method(*args))
+        except Exception as e:
+            logger.warning("函数 %s 执行失败: %s", call.name, e)
+            content = f"函数 {call.name} 执行失败: {e}"
+        return cls._reply(call, content)
+
+    @staticmethod
+    def _reply(call, content):
+        return {"role": "function", "name": call.name, "content": content}
+
+    def close(self):
+        """关闭线程池: 尚未开始的调用被取消 (其结果为错误信息), 已在运行的执行完后丢弃"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            pending = list(self._futures)
+        if executor is None:
+            return
+        # 逐个取消而不是 shutdown(cancel_futures=True): 后者只在 Python 3.9+ 可用,
+        # 且被取消的调用不会唤醒 run 中的 wait; 这里取消后由线程池的线程取出并通知等待方
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+# 默认的执行器 (多个会话共用)
+default_tool_executor = ToolExecutor()
@@ -0,0 +1,267 @@
+"""共享的 HTTP 传输层
+
+为所有 openai 接口调用 (ChatCompletion / Embedding) 提供可配置的长连接池与连接/读取超时,
+并统计连接复用情况 (连接池命中数与新建连接数), 用于确认高负载下连接确实被复用.
+
+同步调用: 在首次调用接口前执行 default_transport.install()
+异步调用: 在协程中执行 openai.aiosession.set(default_transport.async_session())
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import threading
+import time
+import weakref
+
+import aiohttp
+import openai
+import requests
+from openai import api_requestor
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from logger import logger
+
+# 当前调用累计的建连耗时 (见 measure_connect_time)
+_connect_timer = contextvars.ContextVar('connect_timer', default=None)
+
+
+def _record_connect_time(elapsed):
+    timer = _connect_timer.get()
+    if timer is not None:
+        timer[0] = timer[0] + elapsed
+
+
+@contextlib.contextmanager
+def measure_connect_time():
+    """统计代码块内新建连接的耗时 (秒), 复用连接时为 0
+
+    with measure_connect_time() as timer:
+        openai.ChatCompletion.create(...)
+    connect_time = timer[0]
+    """
+    timer = [0.0]
+    token = _connect_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _connect_timer.reset(token)
+
+
+class TransportMetrics:
+    """ 连接复用统计 (线程安全)
+
+    属性:
+    - checkouts (int): 从连接池取用连接的次数
+    - new_connections (int): 新建连接的次数
+    - pool_hits (int): 复用已有连接的次数
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.new_connections = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pool_hits(self):
+        return self.checkouts - self.new_connections
+
+    def record_checkout(self):
+        with self._lock:
+            self.checkouts = self.checkouts + 1
+
+    def record_new_connection(self):
+        with self._lock:
+            self.new_connections = self.new_connections + 1
+
+    def snapshot(self):
+        """返回当前统计 (dict)"""
+        with self._lock:
+            return {"checkouts": self.checkouts,
+                    "new_connections": self.new_connections,
+                    "pool_hits": self.checkouts - self.new_connections}
+
+
+def _counting_pool(base, metrics):
+    """创建会记录取用与新建连接次数 (以及建连耗时) 的连接池类"""
+
+    class TimedConnection(base.ConnectionCls):
+        def connect(self):
+            start = time.monotonic()
+            super().connect()
+            _record_connect_time(time.monotonic() - start)
+
+    class CountingConnectionPool(base):
+        ConnectionCls = TimedConnection
+
+        def _get_conn(self, timeout=None):
+            metrics.record_checkout()
+            return super()._get_conn(timeout)
+
+        def _new_conn(self):
+            metrics.record_new_connection()
+            return super()._new_conn()
+
+    return CountingConnectionPool
+
+
+class _CountingAdapter(HTTPAdapter):
+    def __init__(self, metrics, **kwargs):
+        self.metrics = metrics
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self.metrics),
+            "https": _counting_pool(HTTPSConnectionPool, self.metrics),
+        }
+
+
+class _PersistentSession(requests.Session):
+    """ 长期存活的 requests.Session
+
+    openai 会定期 close() 线程内的 session, 这里忽略 close() 以保留连接池;
+    调用方未指定超时 (使用 openai 默认的 600 秒) 时使用传输层配置的超时.
+    """
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') in (None, api_requestor.TIMEOUT_SECS):
+            kwargs['timeout'] = self.timeout
+        return super().request(method, url, **kwargs)
+
+    def close(self):
+        pass
+
+    def shutdown(self):
+        super().close()
+
+
+class _AsyncSession:
+    """ aiohttp.ClientSession 的代理
+
+    openai 将 request_timeout 转换为 ClientTimeout(total=...), total 限制整个请求 (包括"流式输出"的全部读取),
+    较长的"流式输出"会被截断; 未指定时使用默认的 600 秒. 这里用传输层的 ClientTimeout(connect, sock_read)
+    替换 openai 的默认超时: 建立连接与两次读取之间各自超时, 不限制请求的总时长.
+    """
+
+    def __init__(self, session, timeout):
+        self._session = session
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        timeout = kwargs.get('timeout')
+        if timeout is None or (timeout.total == api_requestor.TIMEOUT_SECS and timeout.connect is None):
+            kwargs['timeout'] = self.timeout
+        return self._session.request(method, url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+class Transport:
+    """ 共享的 HTTP 传输层
+
+    属性:
+    - pool_connections (int): 缓存的连接池数量 (按主机区分)
+    - pool_maxsize (int): 每个主机保持的最大连接数
+    - connect_timeout (float): 建立连接超时 (秒)
+    - read_timeout (float): 读取超时 (秒)
+    - keepalive_timeout (float): 异步连接空闲保活时间 (秒)
+    - metrics (TransportMetrics): 连接复用统计
+
+    方法:
+    - install : 让同步的 openai 调用使用本传输层
+    - async_session : 获取当前事件循环的 aiohttp.ClientSession
+    - close / aclose : 关闭连接池
+    """
+
+    def __init__(self, pool_connections=4, pool_maxsize=32, connect_timeout=5.0, read_timeout=120.0,
+                 keepalive_timeout=60.0):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.metrics = TransportMetrics()
+        self._session = None
+        self._async_sessions = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        """(连接超时, 读取超时)"""
+        return self.connect_timeout, self.read_timeout
+
+    @property
+    def session(self):
+        """同步调用使用的 requests.Session (多线程共享同一个连接池)"""
+        with self._lock:
+            if self._session is None:
+                session = _PersistentSession(self.timeout)
+                adapter = _CountingAdapter(self.metrics,
+                                           pool_connections=self.pool_connections,
+                                           pool_maxsize=self.pool_maxsize,
+                                           max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    def install(self):
+        """让同步的 openai 调用使用本传输层 (需在首次调用接口前执行)"""
+        openai.requestssession = self.session
+        logger.debug("已启用共享 HTTP 连接池")
+        return self
+
+    def async_session(self):
+        """获取当前事件循环的 aiohttp.ClientSession, 不存在时创建"""
+        loop = asyncio.get_running_loop()
+        session = self._async_sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_maxsize,
+                                             keepalive_timeout=self.keepalive_timeout)
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_start.append(self._on_connection_create_start)
+            trace_config.on_connection_create_end.append(self._on_connection_create)
+            trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+            timeout = aiohttp.ClientTimeout(connect=self.connect_timeout, sock_read=self.read_timeout)
+            session = _AsyncSession(aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                                          trace_configs=[trace_config]), timeout)
+            self._async_sessions[loop] = session
+        return session
+
+    async def _on_connection_create_start(self, session, context, params):
+        context.connect_start = time.monotonic()
+
+    async def _on_connection_create(self, session, context, params):
+        self.metrics.record_checkout()
+        self.metrics.record_new_connection()
+        _record_connect_time(time.monotonic() - context.connect_start)
+
+    async def _on_connection_reuse(self, session, context, params):
+        self.metrics.record_checkout()
+
+    def close(self):
+        """关闭同步连接池"""
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.shutdown()
+            if openai.requestssession is session:
+                openai.requestssession = None
+
+    async def aclose(self):
+        """关闭当前事件循环的异步连接池"""
+        session = self._async_sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+
+# 默认的传输层
+default_transport = Transport()